@@ -0,0 +1,6 @@
+"""
+    Benchmarks for the online store
+    datagen: seeded synthetic products, customers and orders
+    run: per-operation throughput and latency at several scales, as JSON
+    Usage: python -m benchmarks.run --backend mock --scales 1000,10000 --output results.json
+"""
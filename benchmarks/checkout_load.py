@@ -0,0 +1,177 @@
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import json
+import random
+import sys
+import time
+
+import online_strone_database as store
+from store_errors import INSUFFICIENT_STOCK, set_quiet
+from benchmarks.datagen import customer_id, order_id, product_id
+from benchmarks.run import BENCH_DATABASE, open_client, fresh_database
+from benchmarks.timing import summarize
+"""
+    Concurrent checkout load test
+    Many workers (threads or processes) place orders with add_order against a small catalog of
+    hot products with limited stock. Afterwards every product is checked: its stock must not be
+    negative and must equal the initial stock minus the quantities in the stored orders.
+    Usage: python -m benchmarks.checkout_load --workers 16 --mode process --orders-per-worker 500 --reserve
+"""
+
+
+def make_cart(rng, n_products, skew_weights):
+    size = rng.choices([1, 2, 3], [60, 30, 10])[0]
+    chosen = set()
+    while len(chosen) < min(size, n_products):
+        chosen.add(rng.choices(range(n_products), cum_weights=skew_weights)[0])
+    return [{"product_id": product_id(index), "quantity": rng.choices([1, 2, 3], [80, 15, 5])[0]}
+            for index in sorted(chosen)]
+
+
+def place_orders(orders_collection, customers_collection, products_collection, worker, options):
+    """
+        Purpose: Place orders_per_worker orders from one worker
+        Return: dict with the latencies, accepted count and rejected counts by StoreError code
+    """
+    rng = random.Random(options["seed"] + worker)
+    n_products = options["products"]
+    skew_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(n_products)))
+    latencies = []
+    accepted = 0
+    rejected = collections.Counter()
+    for number in range(options["orders_per_worker"]):
+        items = make_cart(rng, n_products, skew_weights)
+        start = time.perf_counter()
+        result = store.add_order(orders_collection, customers_collection, products_collection,
+                                 order_id(worker * options["orders_per_worker"] + number),
+                                 customer_id(rng.randrange(options["customers"])), items,
+                                 reserve_stock=options["reserve"], use_transaction=options["transaction"])
+        latencies.append(time.perf_counter() - start)
+        if not result:
+            rejected[result.code] += 1
+        else:
+            accepted += 1
+    return {"latencies": latencies, "accepted": accepted, "rejected": rejected}
+
+
+def process_worker(worker, options):
+    """Worker process entry point, every process opens its own pooled client"""
+    set_quiet()
+    shop = store.Store(options["host"], options["port"], timeout=options["timeout"], database=BENCH_DATABASE)
+    return place_orders(shop.orders, shop.customers, shop.products, worker, options)
+
+
+def setup_catalog(products_collection, customers_collection, options):
+    """
+        Purpose: Add the stock-limited products and the customers
+        Return: dict product_id -> initial stock
+    """
+    initial = {}
+    for index in range(options["products"]):
+        store.add_product(products_collection, product_id(index), f"Hot product {index}", 10.0 + index,
+                          options["stock"], "Load test")
+        initial[product_id(index)] = options["stock"]
+    for index in range(options["customers"]):
+        store.add_customer(customers_collection, customer_id(index), "Load", f"load{index}@example.com",
+                           "123456789", "Load street")
+    return initial
+
+
+def check_stock(products_collection, orders_collection, initial):
+    """
+        Purpose: Compare every product's final stock with its initial stock and the stored orders
+        Return: (oversold, mismatched) lists of {"product_id", "initial", "ordered", "stock"}
+    """
+    # Compact (l.p, l.q) and version 1 (items.product_id, items.quantity) orders
+    pipeline = [
+        {"$project": {"lines": {"$ifNull": ["$l", "$items"]}}},
+        {"$unwind": "$lines"},
+        {"$group": {"_id": {"$ifNull": ["$lines.p", "$lines.product_id"]},
+                    "ordered": {"$sum": {"$ifNull": ["$lines.q", "$lines.quantity"]}}}}
+    ]
+    ordered = {result["_id"]: result["ordered"] for result in orders_collection.aggregate(pipeline)}
+    oversold = []
+    mismatched = []
+    for product in products_collection.find({"product_id": {"$in": list(initial)}}, {"product_id": 1, "stock": 1}):
+        row = {"product_id": product["product_id"],
+               "initial": initial[product["product_id"]],
+               "ordered": ordered.get(product["product_id"], 0),
+               "stock": product["stock"]}
+        if row["stock"] < 0:
+            oversold.append(row)
+        if row["initial"] - row["ordered"] != row["stock"]:
+            mismatched.append(row)
+    return oversold, mismatched
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent checkout load test for add_order")
+    parser.add_argument("--backend", choices=["mongo", "mock"], default="mongo")
+    parser.add_argument("--mode", choices=["thread", "process"], default="thread")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--orders-per-worker", type=int, default=200)
+    parser.add_argument("--products", type=int, default=10, help="number of hot products")
+    parser.add_argument("--stock", type=int, default=100, help="initial stock of every product")
+    parser.add_argument("--customers", type=int, default=50)
+    parser.add_argument("--reserve", action="store_true", help="add_order with reserve_stock=True")
+    parser.add_argument("--transaction", action="store_true", help="add_order with use_transaction=True")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=27017)
+    parser.add_argument("--timeout", type=int, default=1000)
+    args = parser.parse_args(argv)
+    if args.backend == "mock" and args.mode == "process":
+        parser.error("the mock backend only works with --mode thread")
+    options = vars(args)
+
+    client = open_client(args.backend, args.host, args.port, args.timeout)
+    if client is None:
+        print("Quitting...")
+        return 1
+    set_quiet()
+    try:
+        db, products_collection, customers_collection, orders_collection = fresh_database(client)
+        initial = setup_catalog(products_collection, customers_collection, options)
+        start = time.perf_counter()
+        if args.mode == "thread":
+            with concurrent.futures.ThreadPoolExecutor(args.workers) as pool:
+                futures = [pool.submit(place_orders, orders_collection, customers_collection,
+                                       products_collection, worker, options) for worker in range(args.workers)]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(args.workers) as pool:
+                futures = [pool.submit(process_worker, worker, options) for worker in range(args.workers)]
+        runs = [future.result() for future in futures]
+        elapsed = time.perf_counter() - start
+        oversold, mismatched = check_stock(products_collection, orders_collection, initial)
+        client.drop_database(BENCH_DATABASE)
+    finally:
+        client.close()
+
+    latencies = [latency for run in runs for latency in run["latencies"]]
+    accepted = sum(run["accepted"] for run in runs)
+    rejected = sum((run["rejected"] for run in runs), collections.Counter())
+    report = {"mode": args.mode,
+              "workers": args.workers,
+              "reserve_stock": args.reserve,
+              "use_transaction": args.transaction,
+              "accepted": accepted,
+              "rejected_for_stock": rejected[INSUFFICIENT_STOCK],
+              "rejected_other": {code: count for code, count in rejected.items() if code != INSUFFICIENT_STOCK},
+              "orders_per_sec": accepted / elapsed if elapsed else 0.0,
+              "latency": summarize(latencies, elapsed),
+              "oversold": oversold,
+              "mismatched": mismatched,
+              "passed": not oversold and not mismatched}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+    print(text)
+    return 0 if report["passed"] else 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
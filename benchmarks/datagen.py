@@ -0,0 +1,96 @@
+import itertools
+import random
+"""
+    Seeded synthetic data for benchmarks
+    Product popularity follows a Zipf-like distribution, so a few products are in most carts,
+    and cart sizes are skewed towards 1-2 lines like real web shops. The same seed always
+    gives the same data.
+"""
+
+CATEGORIES = ["Peripherals", "PC components", "Monitors", "Storage", "Networking", "Audio", "Laptops", "Cables"]
+PRODUCT_NAMES = ["Keyboard", "Mouse", "Headset", "GPU", "RAM", "CPU", "SSD", "HDD", "Router", "Switch",
+                 "Monitor", "Speaker", "Webcam", "Microphone", "Laptop", "Dock", "Cable", "Charger"]
+FIRST_NAMES = ["Anna", "Joanna", "Zuzanna", "Marianna", "Hanna", "Marzanna", "Lilianna", "Jan", "Piotr", "Ewa"]
+# Lines per cart: 1 .. 8
+CART_SIZE_WEIGHTS = [45, 25, 13, 7, 4, 3, 2, 1]
+
+
+def product_id(index):
+    return f"P{index:07d}"
+
+
+def customer_id(index):
+    return f"C{index:07d}"
+
+
+def order_id(index):
+    return f"o{index:08d}"
+
+
+class DataGenerator:
+    """
+        Purpose: Generate products, customers and orders for a benchmark run
+        Notes: skew is the Zipf exponent of product popularity, 0 makes every product equally likely
+    """
+
+    def __init__(self, n_products, n_customers, n_orders, seed=42, skew=1.1, stock=1_000_000):
+        self.n_products = n_products
+        self.n_customers = n_customers
+        self.n_orders = n_orders
+        self.seed = seed
+        self.skew = skew
+        self.stock = stock
+        # Popularity rank -> product index is shuffled, so hot products are spread over the id range
+        rng = random.Random(seed)
+        ranks = list(range(n_products))
+        rng.shuffle(ranks)
+        self._popular = ranks
+        self._cum_weights = list(itertools.accumulate(1.0 / (rank + 1) ** skew for rank in range(n_products)))
+
+    def products(self):
+        """
+            Return: generator of product dicts with the arguments of add_product
+        """
+        rng = random.Random(self.seed + 1)
+        for index in range(self.n_products):
+            yield {"product_id": product_id(index),
+                   "name": f"{rng.choice(PRODUCT_NAMES)} {index}",
+                   "price": round(rng.lognormvariate(4.5, 1.0), 2),
+                   "stock": self.stock,
+                   "category": rng.choice(CATEGORIES)}
+
+    def customers(self):
+        """
+            Return: generator of customer dicts with the arguments of add_customer
+        """
+        rng = random.Random(self.seed + 2)
+        for index in range(self.n_customers):
+            name = rng.choice(FIRST_NAMES)
+            yield {"customer_id": customer_id(index),
+                   "name": name,
+                   "email": f"{name.lower()}{index}@example.com",
+                   "phone": f"{rng.randrange(100_000_000, 999_999_999)}",
+                   "address": f"Street {rng.randrange(1, 200)}, City {rng.randrange(1, 50)}"}
+
+    def cart(self, rng):
+        """
+            Purpose: One cart with a skewed size and Zipf-distributed products, no product twice
+            Return: list of {"product_id", "quantity"}
+        """
+        size = min(self.n_products, rng.choices(range(1, len(CART_SIZE_WEIGHTS) + 1), CART_SIZE_WEIGHTS)[0])
+        chosen = set()
+        while len(chosen) < size:
+            rank = rng.choices(range(self.n_products), cum_weights=self._cum_weights)[0]
+            chosen.add(self._popular[rank])
+        return [{"product_id": product_id(index), "quantity": rng.choices([1, 2, 3], [80, 15, 5])[0]}
+                for index in sorted(chosen)]
+
+    def orders(self):
+        """
+            Return: generator of order dicts with the arguments of add_order
+        """
+        rng = random.Random(self.seed + 3)
+        for index in range(self.n_orders):
+            yield {"order_id": order_id(index),
+                   "customer_id": customer_id(rng.randrange(self.n_customers)),
+                   "items": self.cart(rng)}
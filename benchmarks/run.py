@@ -0,0 +1,157 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import online_strone_database as store
+from store_errors import set_quiet
+from benchmarks.datagen import DataGenerator, customer_id, order_id
+from benchmarks.timing import summarize, timed
+"""
+    Per-operation benchmark of the store functions
+    For every scale (number of orders) a fresh database is filled with generated data and
+    add_product, add_customer, add_order, view_orders_by_customer, the two aggregations and
+    delete_one are timed call by call. Results are written as JSON so runs on different
+    commits can be compared.
+    Usage: python -m benchmarks.run --backend mongo --scales 1000,10000,100000 --output results.json
+           python -m benchmarks.run --backend mock --scales 1000
+"""
+
+BENCH_DATABASE = "online_store_bench"
+
+
+def open_client(backend, host, port, timeout):
+    """
+        Purpose: Client for the chosen backend, "mongo" is a real mongod, "mock" is in-memory mongomock
+        Return: MongoClient, or None if the server can't be reached
+    """
+    if backend == "mock":
+        try:
+            import mongomock
+        except ImportError:
+            raise SystemExit("The mock backend needs mongomock: pip install mongomock")
+        return mongomock.MongoClient()
+    return store.connect(host, port, timeout)
+
+
+def fresh_database(client):
+    """
+        Purpose: Drop the benchmark database and create it again with its indexes
+        Return: (db, products, customers, orders)
+    """
+    client.drop_database(BENCH_DATABASE)
+    return store.create_database(client, BENCH_DATABASE)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(name, calls, results, scale):
+    """
+        Purpose: Time every call and append the summary to results
+        Notes: calls is an iterable of (function, args, kwargs)
+    """
+    latencies = []
+    start = time.perf_counter()
+    for function, args, kwargs in calls:
+        latencies.append(timed(function, *args, **kwargs)[1])
+    elapsed = time.perf_counter() - start
+    summary = {"scale": scale, "operation": name}
+    summary.update(summarize(latencies, elapsed))
+    results.append(summary)
+
+
+def run_scale(client, scale, seed, samples, repeats):
+    """
+        Purpose: Benchmark every operation at one scale
+        Notes: scale is the number of orders, there are scale // 10 products and scale // 5 customers
+        Return: list of per-operation summaries
+    """
+    data = DataGenerator(n_products=max(10, scale // 10), n_customers=max(10, scale // 5), n_orders=scale,
+                         seed=seed)
+    db, products_collection, customers_collection, orders_collection = fresh_database(client)
+    rng = random.Random(seed)
+    results = []
+
+    measure("add_product", ((store.add_product, (products_collection,), product)
+                            for product in data.products()), results, scale)
+    measure("add_customer", ((store.add_customer, (customers_collection,), customer)
+                             for customer in data.customers()), results, scale)
+    measure("add_order", ((store.add_order, (orders_collection, customers_collection, products_collection), order)
+                          for order in data.orders()), results, scale)
+
+    customer_ids = [customer_id(index)
+                    for index in rng.sample(range(data.n_customers), min(samples, data.n_customers))]
+    measure("view_orders_by_customer", ((store.view_orders_by_customer, (orders_collection, customer), {})
+                                        for customer in customer_ids), results, scale)
+    measure("count_orders_per_customer", ((store.count_orders_per_customer, (orders_collection,), {})
+                                          for _ in range(repeats)), results, scale)
+    measure("total_spent_per_customer", ((store.total_spent_per_customer, (orders_collection,), {})
+                                         for _ in range(repeats)), results, scale)
+    measure("order_report", ((store.order_report, (orders_collection,), {}) for _ in range(repeats)), results, scale)
+
+    order_ids = [order_id(index) for index in rng.sample(range(scale), min(samples, scale))]
+    measure("delete_one", ((store.delete_one, (orders_collection, order), {}) for order in order_ids),
+            results, scale)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the online store operations")
+    parser.add_argument("--backend", choices=["mongo", "mock"], default="mongo")
+    parser.add_argument("--scales", default="1000,10000", help="comma separated numbers of orders")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--samples", type=int, default=200, help="calls of view_orders_by_customer and delete_one")
+    parser.add_argument("--repeats", type=int, default=5, help="calls of every aggregation")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=27017)
+    parser.add_argument("--timeout", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    client = open_client(args.backend, args.host, args.port, args.timeout)
+    if client is None:
+        print("Quitting...")
+        return 1
+    scales = [int(scale) for scale in args.scales.split(",")]
+    results = []
+    # Logging every call would dominate the timings
+    set_quiet()
+    try:
+        for scale in scales:
+            results.extend(run_scale(client, scale, args.seed, args.samples, args.repeats))
+        client.drop_database(BENCH_DATABASE)
+    finally:
+        client.close()
+
+    report = {"meta": {"backend": args.backend,
+                       "scales": scales,
+                       "seed": args.seed,
+                       "commit": git_commit(),
+                       "python": platform.python_version(),
+                       "date": datetime.datetime.now(datetime.timezone.utc).isoformat()},
+              "results": results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+        for result in results:
+            print(f"{result['scale']:>9} {result['operation']:<26} {result['ops_per_sec']:>10.1f} ops/s "
+                  f"p50 {result['p50_ms']:.3f} ms p99 {result['p99_ms']:.3f} ms")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,43 @@
+import time
+"""
+    Latency helpers shared by the benchmarks
+"""
+
+
+def percentile(sorted_values, fraction):
+    """
+        Purpose: Nearest-rank percentile of an already sorted list
+        Return: the value, or 0.0 for an empty list
+    """
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed=None):
+    """
+        Purpose: Summarize call latencies given in seconds
+        Notes: elapsed is the wall time of the whole run, by default the sum of the latencies
+        Return: dict with count, ops_per_sec, mean_ms, p50_ms, p99_ms and max_ms
+    """
+    values = sorted(latencies)
+    if elapsed is None:
+        elapsed = sum(values)
+    count = len(values)
+    return {"count": count,
+            "ops_per_sec": count / elapsed if elapsed else 0.0,
+            "mean_ms": 1000 * sum(values) / count if count else 0.0,
+            "p50_ms": 1000 * percentile(values, 0.50),
+            "p99_ms": 1000 * percentile(values, 0.99),
+            "max_ms": 1000 * values[-1] if values else 0.0}
+
+
+def timed(function, *args, **kwargs):
+    """
+        Purpose: Call a function and measure it
+        Return: (result, seconds)
+    """
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
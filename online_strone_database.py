@@ -1,110 +1,248 @@
+import datetime
+import logging
+import os
 import re
+import threading
+import time
 
 import pymongo
+from bson import ObjectId
+
+import store_monitoring
+from store_errors import StoreError, INVALID, NOT_FOUND, DUPLICATE, INSUFFICIENT_STOCK, FAILED
+from store_monitoring import track
+from store_validation import PRODUCT_VALIDATOR, CUSTOMER_VALIDATOR, ORDER_VALIDATOR
 """
     Online store, with 3 collections: products, customers, orders
     products have: _id, product_id, name, price, stock, category 
     customers have: _id, customer_id, name, email, phone, address 
-    orders have: _id, order_id, customer_id, items
+    orders have: _id, order_id, customer_id and, in the compact version 2 format,
+     v: 2, l: lines [{p: product_id, q: quantity, c: unit price in cents}], t: total in cents.
+     Version 1 orders (no v) have items [{product_id, quantity}] and a float total_price,
+     normalize_order reads both and migrate_orders rewrites version 1 orders.
+    orders_archive has orders moved out of orders by archive_orders, in the same format.
+    customer_stats is kept up to date by the order functions:
+     _id (customer_id), order_count, total_spent, last_order_id
+    Failed operations return a falsy store_errors.StoreError, messages go to the module logger
 """
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_COLLECTION = "orders_archive"
+
+
+def _reject(code, message, **details):
+    """Log a rejected operation and return its StoreError"""
+    logger.warning("%s", message)
+    return StoreError(code, message, **details)
+
+
 def connect(host, port, timeout):
+    """
+        Purpose: Connect and check the server with a blocking round trip
+        Notes: Kept for scripts, Store shares one lazily connected, pooled client per process
+        Return: MongoClient if the server answered, else None
+    """
     try:
         client = pymongo.MongoClient(host, port, serverSelectionTimeoutMS=timeout)
         client.server_info()
         return client
     except Exception as e:
-        print(f"Error: {e}")
+        logger.error("Error: %s", e)
         return None
 
 
-def create_database(client):
-    db = client["online_store"]
+def create_database(client, name="online_store"):
+    db = client[name]
     products_collection = db["products"]
     customers_collection = db["customers"]
     orders_collection = db["orders"]
+    # Indexes, create_index does nothing if the index already exists
+    products_collection.create_index("product_id", unique=True)
+    customers_collection.create_index("customer_id", unique=True)
+    orders_collection.create_index("order_id", unique=True)
+    db[ARCHIVE_COLLECTION].create_index("order_id", unique=True)
+    # Also serves keyset pagination of a customer's orders by _id
+    orders_collection.create_index([("customer_id", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)])
+    # Catalog listings of find_products, ending with its product_id tiebreak so the sort comes from the index:
+    # by category sorted by price or product_id, and by price without a category
+    products_collection.create_index([("category", pymongo.ASCENDING), ("price", pymongo.ASCENDING),
+                                      ("product_id", pymongo.ASCENDING)])
+    products_collection.create_index([("category", pymongo.ASCENDING), ("product_id", pymongo.ASCENDING)])
+    products_collection.create_index([("price", pymongo.ASCENDING), ("product_id", pymongo.ASCENDING)])
+    # Sorted reports
+    db["customer_stats"].create_index([("order_count", pymongo.DESCENDING), ("_id", pymongo.ASCENDING)])
+    db["customer_stats"].create_index([("total_spent", pymongo.DESCENDING), ("_id", pymongo.ASCENDING)])
     return db, products_collection, customers_collection, orders_collection
 
 
-def add_product(products_collection, product_id, name, price, stock, category):
-    # Prevent duplicates
-    if products_collection.find_one({"product_id": product_id}):
-        print(f"Error: product_id {product_id} already exists!")
-        return None
-    # Expected types
-    fields = {"product_id" : str,
-              "name" : str,
-              "price" : (int, float),
-              "stock" : int,
-              "category" : str}
+@track
+def add_product(products_collection, product_id, name, price, stock, category, name_index=None):
     # Actual values
     values = {"product_id": product_id,
               "name": name,
               "price": price,
               "stock": stock,
               "category": category}
-    # Validate types
-    for field_name, expected_type in fields.items():
-        value = values[field_name]
-        if not isinstance(value, expected_type):
-            print(f"Field {field_name} should be of type {expected_type}")
-            return None
-
-    # Check if not empty
-    for field_name, value in values.items():
-        if isinstance(value, float) == True or isinstance(value, int) == True:
-            continue
-        value = value.strip()
-        if len(value) < 1:
-            print(f"{field_name.title()} must be at least 1 character!")
-            return None
+    error = PRODUCT_VALIDATOR.validate(values)
+    if error:
+        return _reject(INVALID, error)
 
-    print(f"Added product with id {product_id}")
-    return products_collection.insert_one(values)
+    # Prevent duplicates, product_id has a unique index
+    try:
+        result = products_collection.insert_one(values)
+    except pymongo.errors.DuplicateKeyError:
+        return _reject(DUPLICATE, f"Error: product_id {product_id} already exists!", product_id=product_id)
+    if name_index is not None:
+        name_index.add(product_id, name)
+    logger.info("Added product with id %s", product_id)
+    return result
 
 
-def update_product(products_collection, product_id, **updates):
-    # Check if product exists
-    if not products_collection.find_one({"product_id": product_id}):
-        print(f"Error: no product with product_id {product_id}!")
-        return None
-    # Expected types
-    fields = {"name": str,
-              "price": (int, float),
-              "stock": int,
-              "category": str}
-    # Check for invalid fields
-    for field_name, value in updates.items():
-        if field_name not in fields:
-            print(f"Field {field_name} is not a valid field for update.")
-            return None
-        # Ensure expected_type is a tuple for isinstance()
-        expected_type = fields[field_name]
-        if not isinstance(expected_type, tuple):
-            expected_type = (expected_type,)
-        # Type check
-        if not isinstance(value, expected_type): # noqa
-            print(f"Error: wrong data type in update_product {updates}")
-            return None
-
-    # Check if not empty
-    for value in updates.values():
-        if not isinstance(value, str):
-            continue
-        value = value.strip()
-        if len(value) < 1:
-            print(f"Update value must be at least 1 character!")
-            return None
+@track
+def update_product(products_collection, product_id, product_cache=None, name_index=None, **updates):
+    # Check fields, types and empty values
+    error = PRODUCT_VALIDATOR.validate_update(updates)
+    if error:
+        return _reject(INVALID, error)
 
-    # Update
+    # Update, a product that doesn't exist matches nothing, so no existence read is needed
     result = products_collection.update_one({"product_id" : product_id}, {"$set" : updates})
+    if not result.matched_count:
+        return _reject(NOT_FOUND, f"Error: no product with product_id {product_id}!", product_id=product_id)
+    if product_cache is not None:
+        product_cache.invalidate(product_id)
+    if name_index is not None and "name" in updates:
+        name_index.add(product_id, updates["name"])
     # If changes made and otherwise
     if result.modified_count:
-        print(f"Updated product {product_id} with updates: {updates}")
+        logger.info("Updated product %s with updates: %s", product_id, updates)
     else:
-        print(f"No changes made to {product_id}")
+        logger.info("No changes made to %s", product_id)
     return result
 
 
+def _bulk_results(product_ids):
+    return {product_id: {"product_id": product_id, "matched": False, "modified": False, "error": None}
+            for product_id in product_ids}
+
+
+def _existing_products(products_collection, product_ids, fields):
+    """One $in read of the given fields of many products, dict product_id -> product"""
+    projection = {"_id": 0, "product_id": 1, **{field_name: 1 for field_name in fields}}
+    return {product["product_id"]: product for product in
+            products_collection.find({"product_id": {"$in": list(product_ids)}}, projection)}
+
+
+def _after_product_writes(product_ids, product_cache=None, name_index=None, names=None):
+    if product_cache is not None:
+        for product_id in product_ids:
+            product_cache.invalidate(product_id)
+    if name_index is not None and names:
+        for product_id, name in names.items():
+            name_index.add(product_id, name)
+
+
+@track
+def update_products_bulk(products_collection, updates, product_cache=None, name_index=None):
+    """
+        Purpose: Update many products at once with the same rules as update_product
+        Notes: updates maps product_id -> dict of fields to set. Existence is checked with one $in read
+         and all valid updates are written with one unordered bulk_write of $set. modified is worked
+         out from the values read before the write, so a concurrent change of the same product can
+         make it stale.
+        Return: list with one dict per product: {"product_id", "matched", "modified", "error"},
+         error holds a StoreError (invalid or not_found) if that update was rejected
+    """
+    results = _bulk_results(updates)
+    fields = {field_name for product_updates in updates.values() if isinstance(product_updates, dict)
+              for field_name in product_updates}
+    existing = _existing_products(products_collection, updates, fields & set(PRODUCT_VALIDATOR.updatable))
+    requests = []
+    names = {}
+    for product_id, product_updates in updates.items():
+        error = (PRODUCT_VALIDATOR.validate_update(product_updates) if isinstance(product_updates, dict)
+                 else f"Error: wrong data type in update_product {product_updates}")
+        if error:
+            results[product_id]["error"] = StoreError(INVALID, error, product_id=product_id)
+            continue
+        if product_id not in existing:
+            results[product_id]["error"] = StoreError(NOT_FOUND, f"Error: no product with product_id {product_id}!",
+                                                      product_id=product_id)
+            continue
+        requests.append(pymongo.UpdateOne({"product_id": product_id}, {"$set": product_updates}))
+        results[product_id]["matched"] = True
+        results[product_id]["modified"] = any(existing[product_id].get(field_name) != value
+                                              for field_name, value in product_updates.items())
+        if "name" in product_updates:
+            names[product_id] = product_updates["name"]
+    if requests:
+        products_collection.bulk_write(requests, ordered=False)
+        _after_product_writes([product_id for product_id, result in results.items() if result["matched"]],
+                              product_cache, name_index, names)
+    logger.info("Updated %d of %d products", len(requests), len(updates))
+    return list(results.values())
+
+
+@track
+def restock(products_collection, quantities, product_cache=None):
+    """
+        Purpose: Add delivered quantities to the stock of many products
+        Notes: quantities maps product_id -> quantity, a positive int. One $in existence check and one
+         unordered bulk_write of $inc, so concurrent orders are not lost.
+        Return: list with one dict per product: {"product_id", "matched", "modified", "error"}
+    """
+    results = _bulk_results(quantities)
+    existing = _existing_products(products_collection, quantities, ())
+    requests = []
+    for product_id, quantity in quantities.items():
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+            results[product_id]["error"] = StoreError(INVALID, f"Error: restock quantity of {product_id} must be "
+                                                               f"a positive integer", product_id=product_id)
+            continue
+        if product_id not in existing:
+            results[product_id]["error"] = StoreError(NOT_FOUND, f"Error: no product with product_id {product_id}!",
+                                                      product_id=product_id)
+            continue
+        requests.append(pymongo.UpdateOne({"product_id": product_id}, {"$inc": {"stock": quantity}}))
+        results[product_id]["matched"] = results[product_id]["modified"] = True
+    if requests:
+        products_collection.bulk_write(requests, ordered=False)
+        _after_product_writes([product_id for product_id, result in results.items() if result["matched"]],
+                              product_cache)
+    logger.info("Restocked %d of %d products", len(requests), len(quantities))
+    return list(results.values())
+
+
+@track
+def reprice_category(products_collection, category, percent, product_cache=None):
+    """
+        Purpose: Change the price of every product in a category by percent, e.g. -10 for 10% off
+        Notes: One update_many with an update pipeline computes the new prices on the server, rounded
+         to cents. The per-product results come from one read of the category before the write,
+         products added to the category meanwhile are repriced but not listed.
+        Return: list with one dict per product: {"product_id", "matched", "modified", "error"},
+         or StoreError if category or percent are invalid
+    """
+    if not isinstance(category, str) or not category.strip():
+        return _reject(INVALID, "Error: category must be at least 1 character!")
+    if not isinstance(percent, (int, float)) or isinstance(percent, bool) or percent <= -100:
+        return _reject(INVALID, f"Error: percent must be a number above -100, not {percent}")
+    factor = 1 + percent / 100
+    before = {product["product_id"]: product["price"] for product in
+              products_collection.find({"category": category}, {"_id": 0, "product_id": 1, "price": 1})}
+    products_collection.update_many({"category": category},
+                                    [{"$set": {"price": {"$round": [{"$multiply": ["$price", factor]}, 2]}}}])
+    results = _bulk_results(before)
+    for product_id, price in before.items():
+        results[product_id]["matched"] = True
+        results[product_id]["modified"] = round(price * factor, 2) != price
+    _after_product_writes(before, product_cache)
+    logger.info("Repriced %d products in %s by %s%%", len(before), category, percent)
+    return list(results.values())
+
+
+@track
 def add_customer(customers_collection, customer_id, name, email, phone, address):
     """
         Purpose: Add a new customer after checking that customer_id is unique, email is valid,
@@ -115,343 +253,1272 @@ def add_customer(customers_collection, customer_id, name, email, phone, address)
             "email" : str
             "phone" : str
             "address" : str
-        Return: InsertOneResult if successful, else None
+        Return: InsertOneResult if successful, else StoreError
     """
-    # Prevent duplicates
-    if customers_collection.find_one({"customer_id": customer_id}):
-        print(f"Customer id must be unique!")
-        return None
-
-    # Validate fields
-    # Expected types
-    fields = {"customer_id": str,
-              "name": str,
-              "email": str,
-              "phone": str,
-              "address": str}
     # Actual values
     values = {"customer_id": customer_id,
               "name": name,
               "email": email,
               "phone": phone,
               "address": address}
-    for field_name, expected_type in fields.items():
-        value = values[field_name]
-        if not isinstance(value, expected_type):
-            print(f"Field {field_name} should be of type {expected_type}")
-            return None
-
-    # Check if not empty
-    for field_name, value in values.items():
-        value = value.strip()
-        if len(value) < 1:
-            print(f"{field_name.title()} must be at least 1 character!")
-            return None
-
-    # Validate email address
-    if email.find("@") == -1:
-        print(f"Invalid email: {email}, must include @")
-        return None
-    email_test = email.split("@")
-    if not email_test[0]:
-        print(f"Invalid email: {email}, username can't be empty or start with @")
-        return None
-    if not email_test[1]:
-        print(f"Invalid email: {email}, domain can't be empty")
-        return None
-    email_test = email_test[1]
-    if email_test.find(".") == -1:
-        print(f"Invalid email: {email}, domain must include .")
-        return None
-    email_test = email_test.split(".")
-    if not email_test[0]:
-        print(f"Invalid email: {email}, left side of domain cant't be empty")
-        return None
-    if not email_test[1]:
-        print(f"Invalid email: {email}, right side of domain cant't be empty")
-        return None
-
-    # Validate email using regex - I wasn't sure if that was allowed
-    valid_email = re.compile(r"[A-Za-z0-9]+@[A-Za-z0-9]+\.[A-Za-z0-9]+")
-    valid_email.match(email)
-    #if not valid_email.match(email):
-    #    print(f"Invalid email: {email}, wrong format")
-    #    return None
-
-
-    # Validate phone number
-    phone_test = list(phone)
-    numbers = 0
-    for val in phone_test:
-        if val.isdigit():
-            numbers += 1
-        else:
-            if val == "-" or val == "(" or val == ")" or val == " ":
-                continue
-            else:
-                print(f"Invalid phone number: {phone}, can't include {val}")
-                return None
-    if numbers < 7:
-        print(f"Invalid phone number: {phone}, can't be less than 7 digits")
-        return None
-
+    # Validate fields
+    error = CUSTOMER_VALIDATOR.validate(values)
+    if error:
+        return _reject(INVALID, error)
 
     new_customer = values
-    result = customers_collection.insert_one(new_customer)
-    print(f"Added customer: {new_customer}")
+    # Prevent duplicates, customer_id has a unique index
+    try:
+        result = customers_collection.insert_one(new_customer)
+    except pymongo.errors.DuplicateKeyError:
+        return _reject(DUPLICATE, "Customer id must be unique!", customer_id=customer_id)
+    logger.info("Added customer: %s", new_customer)
     return result
 
 
+@track
 def update_customer(customers_collection, customer_id, **updates):
     """
         Purpose: Update one or more fields of an existing customer after validating allowed fields and types
         Notes: Fields that can be updated: name, email, phone, address
-        Return: UpdateResult if successful, else None
+        Return: UpdateResult if successful, else StoreError
     """
     # Check if product exists
     if not customers_collection.find_one({"customer_id": customer_id}):
-        print(f"Error: no customer with customer_id {customer_id}!")
-        return None
-    # Expected types
-    fields = {
-              "name": str,
-              "email": str,
-              "phone": str,
-              "address": str}
-
-    # Check for invalid fields
-    for field_name, value in updates.items():
-        if field_name not in fields:
-            print(f"Field {field_name} is not a valid field for update.")
-            return None
-        # Ensure expected_type is a tuple for isinstance()
-        expected_type = fields[field_name]
-        if not isinstance(expected_type, tuple):
-            expected_type = (expected_type,)
-        # Type check
-        if not isinstance(value, expected_type): # noqa
-            print(f"Error: wrong data type in update_customer {updates}")
-            return None
-
-    # Check if not empty
-    for  value in updates.values():
-        value = value.strip()
-        if len(value) < 1:
-            print(f"Update value must be at least 1 character!")
-            return None
-
-    if 'email' in updates.keys():
-        email = updates['email']
-        # Validate email address
-        if email.find("@") == -1:
-            print(f"Invalid email: {email}, must include @")
-            return None
-        email_test = email.split("@")
-        if not email_test[0]:
-            print(f"Invalid email: {email}, username can't be empty or start with @")
-            return None
-        if not email_test[1]:
-            print(f"Invalid email: {email}, domain can't be empty")
-            return None
-        email_test = email_test[1]
-        if email_test.find(".") == -1:
-            print(f"Invalid email: {email}, domain must include .")
-            return None
-        email_test = email_test.split(".")
-        if not email_test[0]:
-            print(f"Invalid email: {email}, left side of domain cant't be empty")
-            return None
-        if not email_test[1]:
-            print(f"Invalid email: {email}, right side of domain cant't be empty")
-            return None
-
-    if 'phone' in updates.keys():
-        phone = updates['phone']
-        # Validate phone number
-        phone_test = list(phone)
-        numbers = 0
-        for val in phone_test:
-            if val.isdigit():
-                numbers += 1
-            else:
-                if val == "-" or val == "(" or val == ")" or val == " ":
-                    continue
-                else:
-                    print(f"Invalid phone number: {phone}, can't include {val}")
-                    return None
-        if numbers < 7:
-            print(f"Invalid phone number: {phone}, can't be less than 7 digits")
-            return None
+        return _reject(NOT_FOUND, f"Error: no customer with customer_id {customer_id}!", customer_id=customer_id)
+    # Check fields, types, empty values, email and phone number
+    error = CUSTOMER_VALIDATOR.validate_update(updates)
+    if error:
+        return _reject(INVALID, error)
 
     # Update
     result = customers_collection.update_one({"customer_id": customer_id}, {"$set" : updates})
     # If changes made and otherwise
     if result.modified_count:
-        print(f"Updated customer {customer_id} with updates: {updates}")
+        logger.info("Updated customer %s with updates: %s", customer_id, updates)
     else:
-        print(f"No changes made to {customer_id}")
+        logger.info("No changes made to %s", customer_id)
     return result
 
 
-def add_order(orders_collection, customers_collection, products_collection, order_id, customer_id, items):
-    # Check if order exists
-    if orders_collection.find_one({"order_id": order_id}):
-        print(f"Error: order_id {order_id} already exists!")
-        return None
-    # Check if customer exists
-    if not customers_collection.find_one({"customer_id": customer_id}):
-        print(f"Error: {customer_id} doesn't exists!")
-        return None
-    # Check if items are not empty
-    if not isinstance(items, list) or not items:
-        print(f"Error: in add-order items must be a non-empty list!")
-        return None
+def _find_products(products_collection, product_ids):
+    """
+        Purpose: Fetch all referenced products with a single $in query
+        Return: dict product_id -> product document
+    """
+    cursor = products_collection.find({"product_id": {"$in": list(set(product_ids))}},
+                                      {"_id": 0, "product_id": 1, "price": 1, "stock": 1})
+    return {product["product_id"]: product for product in cursor}
 
-    # Check if not empty
-    for  value in [order_id, customer_id]:
-        value = value.strip()
-        if len(value) < 1:
-            print(f"All order values must be at least 1 character!")
-            return None
-    for dictionary in items:
-        for value in dictionary.values():
-            if not isinstance(value, str):
-                continue
-            value = value.strip()
-            if len(value) < 1:
-                print(f"All values in items must be at least 1 character!")
-                return None
-
-    order_items = []
-    total_price = 0.0
-    # Check items
+
+def _quantities(items):
+    """
+        Purpose: Sum the ordered quantity per product, a product can appear in more than one line
+        Return: dict product_id -> quantity
+    """
+    quantities = {}
     for item in items:
-        if not isinstance(item, dict):
-            print(f"Error: each item must be a dictionary!")
-            return None
-
-        product_id = item.get("product_id")
-        quantity = item.get("quantity")
-        if not isinstance(product_id, str) or not isinstance(quantity, int):
-            print(f"Error: invalid product_id or quantity type!")
-            return None
-
-        product = products_collection.find_one({"product_id": product_id})
-        if not product:
-            print(f"Error: product {product_id} does not exists")
-            return None
-
-        if product["stock"] < quantity:
-            print(f"Error: insufficient stock for product {product_id}")
-            return None
-
-        price = float(product["price"])
-        total_price += price * quantity
-
-        order_items.append({
-            "product_id": product_id,
-            "quantity": quantity,
-            "price": price,
-        })
+        quantities[item["product_id"]] = quantities.get(item["product_id"], 0) + item["quantity"]
+    return quantities
 
-        # Reduce stock
-    for item in order_items:
-        products_collection.update_one(
-            {"product_id": item["product_id"]},
-            {"$inc": {"stock": -item["quantity"]}}
-        )
-
-    order = {
-        "order_id": order_id,
-        "customer_id": customer_id,
-        "items": items,
-        "total_price": total_price
-    }
-    print(f"Added order {order_id} for customer {customer_id}")
-    return orders_collection.insert_one(order)
-
-
-def view_orders_by_customer(orders_collection, customer_id):
-    print(f"Orders of customer with id {customer_id}:")
-
-    orders = list(orders_collection.find({"customer_id": customer_id}, {'_id': 0}))
-    if not orders:
-        print(f"No orders for customer with id {customer_id}")
+
+ORDER_VERSION = 2
+# Total of an order in either format, for aggregation pipelines
+ORDER_TOTAL = {"$ifNull": [{"$divide": ["$t", 100]}, "$total_price"]}
+
+
+def _cents(price):
+    return round(float(price) * 100)
+
+
+def _order_lines(items, prices):
+    """
+        Purpose: Build compact order lines with the resolved price of every product
+        Return: (lines, total in cents)
+    """
+    lines = []
+    total = 0
+    for item in items:
+        cents = _cents(prices[item["product_id"]])
+        total += cents * item["quantity"]
+        lines.append({"p": item["product_id"], "q": item["quantity"], "c": cents})
+    return lines, total
+
+
+def _new_order(order_id, customer_id, lines, total):
+    """The stored document of a new order, see the module docstring for the format"""
+    return {"order_id": order_id,
+            "customer_id": customer_id,
+            "v": ORDER_VERSION,
+            "l": lines,
+            "t": total}
+
+
+def order_total(order):
+    """Total price of a stored order of either version as a float"""
+    if order.get("v", 1) >= 2:
+        return order["t"] / 100
+    return order["total_price"]
+
+
+def normalize_order(order):
+    """
+        Purpose: Readable form of a stored order of either version
+        Notes: Fields left out by a projection are left out of the result too
+        Return: dict with _id, order_id, customer_id, items [{product_id, quantity, price}] and total_price,
+         as far as the document has them. price is missing in lines of version 1 orders.
+    """
+    if order.get("v", 1) < 2:
+        return order
+    normalized = {field: order[field] for field in ("_id", "order_id", "customer_id") if field in order}
+    if "l" in order:
+        normalized["items"] = [{"product_id": line["p"], "quantity": line["q"], "price": line["c"] / 100}
+                               for line in order["l"]]
+    if "t" in order:
+        normalized["total_price"] = order["t"] / 100
+    return normalized
+
+
+# Order fields that have another name in the other version
+ORDER_FIELD_NAMES = {"items": ("items", "l"), "l": ("items", "l"), "total_price": ("total_price", "t"),
+                     "t": ("total_price", "t")}
+
+
+def order_projection(projection):
+    """
+        Purpose: Projection over orders of both versions from one in either naming
+        Notes: items/l and total_price/t select the field of both versions, an inclusion projection
+         also returns v so normalize_order can tell the versions apart
+        Return: projection dict, or None if projection is None
+    """
+    if not projection:
+        return projection
+    translated = {}
+    for field, value in projection.items():
+        for name in ORDER_FIELD_NAMES.get(field, (field,)):
+            translated[name] = value
+    if any(value for field, value in projection.items() if field != "_id"):
+        translated["v"] = 1
+    else:
+        translated.pop("v", None)
+    return translated
+
+
+def _price_items(items, products, stock_left):
+    """
+        Purpose: Resolve item prices and check the order against the stock still available
+        Notes: stock_left maps product_id -> available stock, it is decremented only if the whole order fits
+        Return: (lines, total in cents, quantities, None) if successful, else (None, None, None, StoreError)
+    """
+    quantities = _quantities(items)
+    for product_id, quantity in quantities.items():
+        if product_id not in products:
+            return None, None, None, StoreError(NOT_FOUND, f"Error: product {product_id} does not exists",
+                                                product_id=product_id)
+        if stock_left[product_id] < quantity:
+            return None, None, None, StoreError(INSUFFICIENT_STOCK,
+                                                f"Error: insufficient stock for product {product_id}",
+                                                product_id=product_id)
+
+    lines, total = _order_lines(items, {product_id: products[product_id]["price"] for product_id in quantities})
+    for product_id, quantity in quantities.items():
+        stock_left[product_id] -= quantity
+    return lines, total, quantities, None
+
+
+def _change_stock(products_collection, quantities, sign=-1, session=None):
+    """
+        Purpose: Apply stock changes for many products in one bulk_write
+        Notes: sign=-1 takes the quantities out of stock, sign=1 puts them back
+        Return: BulkWriteResult, or None if there is nothing to change
+    """
+    requests = [pymongo.UpdateOne({"product_id": product_id}, {"$inc": {"stock": sign * quantity}})
+                for product_id, quantity in quantities.items() if quantity]
+    if not requests:
         return None
+    return products_collection.bulk_write(requests, ordered=False, session=session)
 
-    for order in orders:
-        print(order)
 
-    return orders
+def _update_customer_stats(orders_collection, orders, sign=1, session=None):
+    """
+        Purpose: Add orders to (sign=1) or remove them from (sign=-1) the customer_stats collection
+        Notes: One bulk_write with one $inc per customer, in the same write path as the orders. Only
+         additions create a customer's entry. When removed orders include a customer's last_order_id,
+         call it after deleting them: last_order_id is set to the customer's latest remaining order.
+        Return: BulkWriteResult, or None if there are no orders
+    """
+    changes = {}
+    for order in orders:
+        change = changes.setdefault(order["customer_id"], {"order_count": 0, "total_spent": 0.0, "orders": []})
+        change["order_count"] += sign
+        change["total_spent"] += sign * order_total(order)
+        change["orders"].append(order["order_id"])
+    stats_collection = orders_collection.database["customer_stats"]
+    last_orders = {}
+    if sign < 0 and changes:
+        last_orders = _latest_orders(orders_collection, [
+            stats["_id"] for stats in stats_collection.find(
+                {"_id": {"$in": list(changes)},
+                 "last_order_id": {"$in": [order_id for change in changes.values() for order_id in change["orders"]]}},
+                {"_id": 1}, session=session)], session=session)
+    requests = []
+    for customer_id, change in changes.items():
+        update = {"$inc": {"order_count": change["order_count"], "total_spent": change["total_spent"]}}
+        if sign > 0:
+            update["$set"] = {"last_order_id": change["orders"][-1]}
+            requests.append(pymongo.UpdateOne({"_id": customer_id}, update, upsert=True))
+            continue
+        # A customer without an entry has nothing to remove, a rebuild counts it correctly
+        requests.append(pymongo.UpdateOne({"_id": customer_id}, update))
+        if customer_id in last_orders:
+            requests.append(pymongo.UpdateOne({"_id": customer_id, "last_order_id": {"$in": change["orders"]}},
+                                              {"$set": {"last_order_id": last_orders[customer_id]}}))
+    if not requests:
+        return None
+    try:
+        return stats_collection.bulk_write(requests, ordered=False, session=session)
+    except pymongo.errors.BulkWriteError as e:
+        # Two concurrent first orders of a customer can both try to insert its entry, retry the loser once
+        if session is not None or any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+        retry = [requests[error["index"]] for error in e.details["writeErrors"]]
+        return stats_collection.bulk_write(retry, ordered=False)
 
 
-def count_orders_per_customer(orders_collection):
-    print("Number of orders per customer: ")
+def _latest_orders(orders_collection, customer_ids, session=None):
+    """
+        Purpose: Latest order_id (by _id) of each customer, in orders or else in orders_archive
+        Return: dict customer_id -> order_id, None for customers without any order
+    """
+    latest = dict.fromkeys(customer_ids)
+    for collection in (orders_collection, orders_collection.database[ARCHIVE_COLLECTION]):
+        missing = [customer_id for customer_id, order_id in latest.items() if order_id is None]
+        if not missing:
+            break
+        for row in collection.aggregate([{"$match": {"customer_id": {"$in": missing}}},
+                                         {"$sort": {"_id": 1}},
+                                         {"$group": {"_id": "$customer_id", "order_id": {"$last": "$order_id"}}}],
+                                        session=session):
+            latest[row["_id"]] = row["order_id"]
+    return latest
+
+
+@track
+def rebuild_customer_stats(orders_collection):
+    """
+        Purpose: Recompute customer_stats from scratch from the orders and orders_archive collections
+        Notes: Archived orders still count for their customer. Runs on the server with $unionWith,
+         $group and $merge, entries of customers without orders are
+         removed afterwards. Orders added while it runs may be counted twice or not at all, so run it
+         while order writes are paused. Required once on a database with orders from before
+         customer_stats existed, until then the reports only count newer orders.
+        Return: number of customers with stats
+    """
+    rebuilt_at = datetime.datetime.now(datetime.timezone.utc)
     pipeline = [
+        {"$unionWith": ARCHIVE_COLLECTION},
+        {"$sort": {"_id": 1}},
         {"$group": {
             "_id": "$customer_id",
-            "count": {"$sum": 1}
+            "order_count": {"$sum": 1},
+            "total_spent": {"$sum": ORDER_TOTAL},
+            "last_order_id": {"$last": "$order_id"}
         }},
-        {"$sort": {"count": -1}}  # DESC
+        {"$set": {"rebuilt_at": rebuilt_at}},
+        {"$merge": {"into": "customer_stats", "whenMatched": "replace", "whenNotMatched": "insert"}}
     ]
-    for result in orders_collection.aggregate(pipeline):
-        print(result["_id"], ':', result["count"])
+    orders_collection.aggregate(pipeline, allowDiskUse=True)
+    stats_collection = orders_collection.database["customer_stats"]
+    stats_collection.delete_many({"rebuilt_at": {"$ne": rebuilt_at}})
+    count = stats_collection.count_documents({})
+    logger.info("Rebuilt stats of %d customers", count)
+    return count
 
 
-def total_spent_per_customer(orders_collection):
-    print("Total spent per customer: ")
-    pipeline = [
-        {"$group": {
-            "_id": "$customer_id",
-            "total_spent": {"$sum": "$total_price"}
-        }},
-        {"$sort": {"total_spent": -1}}
-    ]
-    for result in orders_collection.aggregate(pipeline):
-        print(result["_id"], ':', "{number:.2f}".format(number=result["total_spent"]))
+@track
+def migrate_orders(orders_collection, products_collection, batch_size=1000, after=None, pause=0.0):
+    """
+        Purpose: Rewrite version 1 orders in the compact version 2 format
+        Notes: Works in batches in _id order: one read of batch_size orders, one $in read of their
+         products and one bulk_write of replacements. A replacement only applies if the order is still
+         version 1, so it is safe to run while orders are added, and it can be stopped at any time and
+         started again; migrated orders are not read again. after is an _id (the last one logged) to
+         resume from. Version 1 orders did not keep line prices, a line's price is taken from the
+         product's current price (0 for deleted products), the order total is kept as it was.
+         pause sleeps that many seconds between batches to limit the load.
+        Return: dict with the number of orders "migrated" and "skipped" (changed by someone else meanwhile)
+    """
+    counts = {"migrated": 0, "skipped": 0}
+    query = {"v": {"$exists": False}}
+    last_id = _decode_token(after, "_id") if after is not None else None
+    while True:
+        batch_query = dict(query)
+        if last_id is not None:
+            batch_query["_id"] = {"$gt": last_id}
+        orders = list(orders_collection.find(batch_query).sort("_id", pymongo.ASCENDING).limit(batch_size))
+        if not orders:
+            break
+        prices = {product["product_id"]: product["price"] for product in
+                  products_collection.find({"product_id": {"$in": list({item["product_id"] for order in orders
+                                                                      for item in order["items"]})}},
+                                           {"_id": 0, "product_id": 1, "price": 1})}
+        requests = []
+        for order in orders:
+            lines = [{"p": item["product_id"],
+                      "q": item["quantity"],
+                      "c": _cents(item.get("price", prices.get(item["product_id"], 0)))}
+                     for item in order["items"]]
+            document = _new_order(order["order_id"], order["customer_id"], lines, _cents(order["total_price"]))
+            requests.append(pymongo.ReplaceOne({"_id": order["_id"], "v": {"$exists": False}}, document))
+        result = orders_collection.bulk_write(requests, ordered=False)
+        counts["migrated"] += result.modified_count
+        counts["skipped"] += len(requests) - result.modified_count
+        last_id = orders[-1]["_id"]
+        logger.info("Migrated %d orders, last _id %s", counts["migrated"], last_id)
+        if pause:
+            time.sleep(pause)
+    logger.info("Migrated %d orders to version %d, %d skipped", counts["migrated"], ORDER_VERSION, counts["skipped"])
+    return counts
+
+
+def _reserve_stock(products_collection, quantities, session=None, known_prices=None):
+    """
+        Purpose: Take stock for every product with a conditional update, stock >= quantity
+        Notes: The filter makes the stock check and the decrement one atomic operation, so concurrent
+         orders can't oversell and no pre-read is needed. The price is read in the same round trip,
+         unless known_prices (e.g. from the product cache) already has it. Outside a transaction, products
+         already reserved are given back when a later one fails; inside one, aborting the transaction does it.
+        Return: (prices, None) with prices product_id -> price if successful, else (None, StoreError)
+    """
+    prices = {}
+    for product_id, quantity in quantities.items():
+        stock_filter = {"product_id": product_id, "stock": {"$gte": quantity}}
+        if known_prices is not None and product_id in known_prices:
+            reserved = products_collection.update_one(stock_filter, {"$inc": {"stock": -quantity}},
+                                                      session=session).matched_count
+            price = known_prices[product_id]
+        else:
+            product = products_collection.find_one_and_update(stock_filter, {"$inc": {"stock": -quantity}},
+                                                              projection={"_id": 0, "price": 1}, session=session)
+            reserved = product is not None
+            price = product["price"] if reserved else None
+        if not reserved:
+            if session is None:
+                _change_stock(products_collection, {reserved_id: quantities[reserved_id] for reserved_id in prices},
+                              sign=1)
+            # Only failed reservations pay for a read, to tell the reason
+            if not products_collection.find_one({"product_id": product_id}, {"_id": 1}, session=session):
+                return None, StoreError(NOT_FOUND, f"Error: product {product_id} does not exists",
+                                        product_id=product_id)
+            return None, StoreError(INSUFFICIENT_STOCK, f"Error: insufficient stock for product {product_id}",
+                                    product_id=product_id)
+        prices[product_id] = price
+    return prices, None
+
+
+def _archived_order_ids(orders_collection, order_ids):
+    """The order_ids that are already in orders_archive, with one $in read of its unique order_id index"""
+    return {order["order_id"] for order in orders_collection.database[ARCHIVE_COLLECTION].find(
+        {"order_id": {"$in": list(order_ids)}}, {"_id": 0, "order_id": 1})}
+
+
+class _OrderRejected(Exception):
+    """Raised inside an order transaction to abort it"""
+
+
+def _add_order_transaction(orders_collection, products_collection, order_id, customer_id, items, known_prices=None):
+    """
+        Purpose: Reserve stock and insert the order in one multi-document transaction
+        Notes: Needs a replica set. with_transaction retries on transient errors such as write conflicts
+         between concurrent orders of the same product.
+        Return: InsertOneResult if successful, else StoreError
+    """
+    quantities = _quantities(items)
+
+    def place(session):
+        prices, error = _reserve_stock(products_collection, quantities, session=session, known_prices=known_prices)
+        if error:
+            raise _OrderRejected(error)
+        lines, total = _order_lines(items, prices)
+        order = _new_order(order_id, customer_id, lines, total)
+        try:
+            result = orders_collection.insert_one(order, session=session)
+        except pymongo.errors.DuplicateKeyError:
+            raise _OrderRejected(StoreError(DUPLICATE, f"Error: order_id {order_id} already exists!",
+                                            order_id=order_id))
+        _update_customer_stats(orders_collection, [order], session=session)
+        return result
+
+    try:
+        with orders_collection.database.client.start_session() as session:
+            result = session.with_transaction(place)
+    except _OrderRejected as e:
+        logger.warning("%s", e.args[0])
+        return e.args[0]
+    logger.info("Added order %s for customer %s", order_id, customer_id)
+    return result
+
+
+@track
+def add_order(orders_collection, customers_collection, products_collection, order_id, customer_id, items,
+              reserve_stock=False, use_transaction=False, product_cache=None, check_archive=False, order_filter=None):
+    """
+        Purpose: Add a new order after checking that order_id is unique, the customer exists
+         and every product has enough stock
+        Notes: By default all products are fetched with one $in query and stock is reduced with one bulk_write.
+         reserve_stock=True skips the pre-read and reserves each product with a conditional update
+         (stock >= quantity), giving back what was reserved if a product fails, so concurrent
+         orders can't oversell. use_transaction=True does the reservation and the insert in one
+         transaction (replica set only). With a product_cache prices come from the cache and stock
+         is always reserved with the conditional update, since cached stock may be stale.
+         order_id uniqueness comes from the unique index, a duplicate gives the stock back. That index
+         doesn't see archived orders: check_archive=True also rejects their order_ids, at the cost of one
+         indexed read of orders_archive per order. Otherwise archive_orders leaves a reused order_id in
+         orders.
+         order_filter is a store_idfilter filter of order_ids: an order_id it may have is looked up
+         first, so a duplicate is rejected before any stock is taken. It saves no query, a miss goes on
+         as without a filter and a possible hit costs one lookup.
+         A miss is never trusted beyond that, the unique index still decides. New order_ids are added.
+        Return: InsertOneResult if successful, else StoreError with code not_found, invalid,
+         insufficient_stock or duplicate
+    """
+    # Check if customer exists
+    if not customers_collection.find_one({"customer_id": customer_id}):
+        return _reject(NOT_FOUND, f"Error: {customer_id} doesn't exists!", customer_id=customer_id)
+    error = ORDER_VALIDATOR.validate({"order_id": order_id, "customer_id": customer_id, "items": items})
+    if error:
+        return _reject(INVALID, error)
+    # Only possible duplicates are looked up, the unique index still decides
+    if order_filter is not None and order_filter.might_contain(order_id):
+        if orders_collection.find_one({"order_id": order_id}, {"_id": 1}):
+            order_filter.duplicate()
+            return _reject(DUPLICATE, f"Error: order_id {order_id} already exists!", order_id=order_id)
+        order_filter.false_positive()
+    # The unique index of orders doesn't see archived orders
+    if check_archive and _archived_order_ids(orders_collection, [order_id]):
+        return _reject(DUPLICATE, f"Error: order_id {order_id} already exists!", order_id=order_id)
+
+    known_prices = None
+    if product_cache is not None:
+        known_prices = {product_id: product["price"] for product_id, product in
+                        product_cache.get_many([item["product_id"] for item in items]).items()}
+
+    if use_transaction:
+        result = _add_order_transaction(orders_collection, products_collection, order_id, customer_id, items,
+                                        known_prices=known_prices)
+        if result and order_filter is not None:
+            order_filter.add(order_id)
+        return result
+
+    if reserve_stock or product_cache is not None:
+        # Check items and reduce stock in one step
+        quantities = _quantities(items)
+        prices, error = _reserve_stock(products_collection, quantities, known_prices=known_prices)
+        if error is not None:
+            logger.warning("%s", error)
+            return error
+        lines, total = _order_lines(items, prices)
+    else:
+        # Check items
+        products = _find_products(products_collection, [item["product_id"] for item in items])
+        stock_left = {product_id: product["stock"] for product_id, product in products.items()}
+        lines, total, quantities, error = _price_items(items, products, stock_left)
+        if error is not None:
+            logger.warning("%s", error)
+            return error
+        # Reduce stock
+        _change_stock(products_collection, quantities)
+
+    order = _new_order(order_id, customer_id, lines, total)
+    # Check if order exists, order_id has a unique index
+    try:
+        result = orders_collection.insert_one(order)
+    except pymongo.errors.DuplicateKeyError:
+        _change_stock(products_collection, quantities, sign=1)
+        return _reject(DUPLICATE, f"Error: order_id {order_id} already exists!", order_id=order_id)
+    if order_filter is not None:
+        order_filter.add(order_id)
+    _update_customer_stats(orders_collection, [order])
+    logger.info("Added order %s for customer %s", order_id, customer_id)
+    return result
+
+
+@track
+def add_orders_bulk(orders_collection, customers_collection, products_collection, orders, check_archive=False,
+                    order_filter=None):
+    """
+        Purpose: Add many orders at once with the same rules as add_order
+        Notes: orders is a list of dicts with order_id, customer_id and items.
+         Customers and products are each fetched with one $in query, stock is reduced with one
+         bulk_write and orders are written with one insert_many. Duplicate order_ids are reported
+         by the unique index on insert and their stock is given back. check_archive=True also rejects
+         archived order_ids, found with one $in read of orders_archive.
+         Orders are checked in list order, so earlier orders in the batch take stock first.
+         With an order_filter the order_ids it may have are looked up with one extra $in read first, so
+         those duplicates take no stock. Added order_ids go into the filter.
+        Return: list with one dict per order: {"order_id", "inserted_id", "error"},
+         inserted_id is None and error holds a StoreError if that order was rejected
+    """
+    results = [{"order_id": order.get("order_id") if isinstance(order, dict) else None,
+                "inserted_id": None, "error": None} for order in orders]
+    valid = []
+    for index, error in enumerate(ORDER_VALIDATOR.validate_many(orders)):
+        if error:
+            results[index]["error"] = StoreError(INVALID, error)
+            continue
+        valid.append(index)
+
+    # Duplicates inside the batch and of archived orders, other duplicates of stored orders fail on insert
+    batch_orders = set()
+    taken = set()
+    if valid:
+        if check_archive:
+            taken = _archived_order_ids(orders_collection, {orders[index]["order_id"] for index in valid})
+        customer_ids = list({orders[index]["customer_id"] for index in valid})
+        existing_customers = {customer["customer_id"] for customer in
+                              customers_collection.find({"customer_id": {"$in": customer_ids}},
+                                                        {"_id": 0, "customer_id": 1})}
+        if order_filter is not None:
+            possible = [order_id for order_id in dict.fromkeys(orders[index]["order_id"] for index in valid)
+                        if order_filter.might_contain(order_id)]
+            if possible:
+                stored = {order["order_id"] for order in orders_collection.find({"order_id": {"$in": possible}},
+                                                                                {"_id": 0, "order_id": 1})}
+                order_filter.duplicate(len(stored))
+                order_filter.false_positive(len(possible) - len(stored))
+                taken |= stored
+        products = _find_products(products_collection,
+                                  [item["product_id"] for index in valid for item in orders[index]["items"]])
+        stock_left = {product_id: product["stock"] for product_id, product in products.items()}
+
+    accepted = []
+    new_orders = []
+    order_quantities = []
+    for index in valid:
+        order = orders[index]
+        if order["order_id"] in batch_orders or order["order_id"] in taken:
+            results[index]["error"] = StoreError(DUPLICATE, f"Error: order_id {order['order_id']} already exists!",
+                                                 order_id=order["order_id"])
+            continue
+        if order["customer_id"] not in existing_customers:
+            results[index]["error"] = StoreError(NOT_FOUND, f"Error: {order['customer_id']} doesn't exists!",
+                                                 customer_id=order["customer_id"])
+            continue
+        lines, total, quantities, error = _price_items(order["items"], products, stock_left)
+        if error is not None:
+            results[index]["error"] = error
+            continue
+        batch_orders.add(order["order_id"])
+        accepted.append(index)
+        order_quantities.append(quantities)
+        new_orders.append(_new_order(order["order_id"], order["customer_id"], lines, total))
+
+    if new_orders:
+        # Reduce stock
+        total_quantities = {}
+        for quantities in order_quantities:
+            for product_id, quantity in quantities.items():
+                total_quantities[product_id] = total_quantities.get(product_id, 0) + quantity
+        _change_stock(products_collection, total_quantities)
+
+        failed = {}
+        try:
+            orders_collection.insert_many(new_orders, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            failed = {error["index"]: error for error in e.details["writeErrors"]}
+        # Give back the stock of orders that could not be written
+        restore = {}
+        for position, index in enumerate(accepted):
+            if position in failed:
+                if failed[position]["code"] == 11000:
+                    results[index]["error"] = StoreError(DUPLICATE,
+                                                         f"Error: order_id {orders[index]['order_id']} already exists!",
+                                                         order_id=orders[index]["order_id"])
+                else:
+                    results[index]["error"] = StoreError(FAILED,
+                                                         f"Error: order {orders[index]['order_id']} not added: "
+                                                         f"{failed[position]['errmsg']}",
+                                                         order_id=orders[index]["order_id"])
+                for product_id, quantity in order_quantities[position].items():
+                    restore[product_id] = restore.get(product_id, 0) + quantity
+            else:
+                results[index]["inserted_id"] = new_orders[position]["_id"]
+                if order_filter is not None:
+                    order_filter.add(new_orders[position]["order_id"])
+        _change_stock(products_collection, restore, sign=1)
+        _update_customer_stats(orders_collection, [order for position, order in enumerate(new_orders)
+                                                   if position not in failed])
+
+    added = sum(1 for result in results if result["error"] is None)
+    logger.info("Added %d of %d orders", added, len(orders))
+    return results
+
+
+@track
+def iter_orders_by_customer(orders_collection, customer_id, batch_size=1000, projection=None, after=None,
+                            limit=None):
+    """
+        Purpose: Stream the orders of one customer in _id order
+        Notes: Uses the customer_id, _id index, see iter_all for the parameters. Orders of both versions
+         come in the normalize_order form, a projection can use either field names (see order_projection).
+        Return: generator of order documents
+    """
+    for order in iter_all(orders_collection, batch_size=batch_size, projection=order_projection(projection),
+                          after=after, limit=limit, query={"customer_id": customer_id}):
+        yield normalize_order(order)
+
+
+@track
+def view_orders_by_customer(orders_collection, customer_id, batch_size=1000, limit=None):
+    orders = list(iter_orders_by_customer(orders_collection, customer_id, batch_size=batch_size,
+                                          projection={'_id': 0}, limit=limit))
+    if not orders:
+        logger.info("No orders for customer with id %s", customer_id)
+        return StoreError(NOT_FOUND, f"No orders for customer with id {customer_id}", customer_id=customer_id)
+
+    # Formatting every document is only paid for when DEBUG output is on
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Orders of customer with id %s:", customer_id)
+        for order in orders:
+            logger.debug("%s", order)
+    return orders
+
 
+def _customer_rows_pipeline(customer_ids=None, order_ids=None, sort_by=None):
+    """
+        Purpose: Build the aggregation giving one order report row per customer
+        Notes: Without an order_ids filter it runs on customer_stats, which already has one row per customer,
+         otherwise it groups the matching orders, archived ones included. sort_by ("order_count" or
+         "total_spent") sorts the rows highest first before they are renamed, so on customer_stats the
+         sort runs on its (sort_by, _id) index.
+        Return: (collection name, pipeline)
+    """
+    if order_ids is None:
+        collection_name = "customer_stats"
+        match = {"order_count": {"$gt": 0}}
+        if customer_ids is not None:
+            match["_id"] = {"$in": list(customer_ids)}
+        pipeline = [{"$match": match}]
+    else:
+        collection_name = "orders"
+        match = {"order_id": {"$in": list(order_ids)}}
+        if customer_ids is not None:
+            match["customer_id"] = {"$in": list(customer_ids)}
+        pipeline = [
+            {"$match": match},
+            {"$unionWith": {"coll": ARCHIVE_COLLECTION, "pipeline": [{"$match": match}]}},
+            {"$group": {
+                "_id": "$customer_id",
+                "order_count": {"$sum": 1},
+                "total_spent": {"$sum": ORDER_TOTAL}
+            }}
+        ]
+    if sort_by is not None:
+        pipeline.append({"$sort": {sort_by: -1, "_id": 1}})  # DESC
+    pipeline.append({"$project": {
+        "_id": 0,
+        "customer_id": "$_id",
+        "order_count": 1,
+        "total_spent": 1,
+        "average_order": {"$divide": ["$total_spent", "$order_count"]}
+    }})
+    return collection_name, pipeline
+
+
+def _report_pipeline(customer_ids=None, order_ids=None, top_n=10):
+    """
+        Purpose: Build the order report aggregation
+        Notes: $facet returns a single document of at most 16 MB, so it only holds the totals and the
+         top_n top customers. Without top_n the top customers are streamed by iter_customer_rows instead.
+        Return: (collection name, pipeline)
+    """
+    collection_name, pipeline = _customer_rows_pipeline(customer_ids, order_ids)
+    facets = {"totals": [{"$group": {
+        "_id": None,
+        "customers": {"$sum": 1},
+        "orders": {"$sum": "$order_count"},
+        "total_spent": {"$sum": "$total_spent"}
+    }}]}
+    if top_n:
+        facets["top_customers"] = [{"$sort": {"total_spent": -1, "customer_id": 1}}, {"$limit": top_n}]
+    pipeline.append({"$facet": facets})
+    return collection_name, pipeline
+
+
+def _report_result(facets, top_customers=None):
+    """Turn the $facet output into the order report dict"""
+    totals = facets["totals"][0] if facets["totals"] else {"customers": 0, "orders": 0, "total_spent": 0.0}
+    totals.pop("_id", None)
+    totals["average_order"] = totals["total_spent"] / totals["orders"] if totals["orders"] else 0.0
+    return {"top_customers": facets["top_customers"] if top_customers is None else top_customers,
+            "totals": totals}
+
+
+def iter_customer_rows(orders_collection, customer_ids=None, order_ids=None, sort_by="order_count",
+                       batch_size=1000, allow_disk_use=False):
+    """
+        Purpose: Stream the order report rows, one per customer, sort_by ("order_count" or "total_spent")
+         highest first
+        Notes: Same filters as order_report. Rows come from a cursor, so the number of customers is not
+         limited by the 16 MB document size.
+        Return: generator of {"customer_id", "order_count", "total_spent", "average_order"}
+    """
+    collection_name, pipeline = _customer_rows_pipeline(customer_ids, order_ids, sort_by)
+    cursor = orders_collection.database[collection_name].aggregate(pipeline, allowDiskUse=allow_disk_use,
+                                                                   batchSize=batch_size)
+    with cursor:
+        yield from cursor
 
-def delete_one(collection, _id):
+
+@track
+def order_report(orders_collection, customer_ids=None, order_ids=None, top_n=10, allow_disk_use=False):
+    """
+        Purpose: Totals and top customers by spend in one aggregation
+        Notes: customer_ids and order_ids limit the report to those customers or orders. Without order_ids
+         the report reads customer_stats; with them it makes one pass over the matching orders.
+         top_n=None streams every customer into top_customers with a second query.
+         allow_disk_use lets large groups spill to disk.
+        Return: dict with
+            "top_customers": [{"customer_id", "order_count", "total_spent", "average_order"}], highest
+             total_spent first, at most top_n
+            "totals": {"customers", "orders", "total_spent", "average_order"}
+    """
+    collection_name, pipeline = _report_pipeline(customer_ids, order_ids, top_n)
+    facets = next(orders_collection.database[collection_name].aggregate(pipeline, allowDiskUse=allow_disk_use))
+    top_customers = None
+    if not top_n:
+        top_customers = list(iter_customer_rows(orders_collection, customer_ids, order_ids, "total_spent",
+                                                allow_disk_use=allow_disk_use))
+    return _report_result(facets, top_customers)
+
+
+@track
+def count_orders_per_customer(orders_collection, customer_ids=None, order_ids=None):
+    customers = []
+    log = logger.isEnabledFor(logging.INFO)
+    if log:
+        logger.info("Number of orders per customer: ")
+    for result in iter_customer_rows(orders_collection, customer_ids, order_ids, "order_count"):
+        if log:
+            logger.info("%s : %d", result["customer_id"], result["order_count"])
+        customers.append(result)
+    return customers
+
+
+@track
+def total_spent_per_customer(orders_collection, customer_ids=None, order_ids=None):
+    customers = []
+    log = logger.isEnabledFor(logging.INFO)
+    if log:
+        logger.info("Total spent per customer: ")
+    for result in iter_customer_rows(orders_collection, customer_ids, order_ids, "total_spent"):
+        if log:
+            logger.info("%s : %.2f", result["customer_id"], result["total_spent"])
+        customers.append(result)
+    return customers
+
+
+@track
+def delete_one(collection, _id, product_cache=None, name_index=None, id_filter=None):
     # Check if exists
     name = str(collection.name[0:-1])
     item = collection.find_one({name + "_id" : _id})
     if not item:
-        print(f"No {name} with {name + "_id"} {_id}")
-        return None
+        return _reject(NOT_FOUND, f"No {name} with {name + "_id"} {_id}")
     else:
-        print(f"Deleting {name} with {name + "_id"} {_id}")
-        return collection.delete_one({name + "_id" : _id})
-
-
-def view_one(collection, _id):
+        logger.info("Deleting %s with %s_id %s", name, name, _id)
+        result = collection.delete_one({name + "_id" : _id})
+        if product_cache is not None and collection.name == "products":
+            product_cache.invalidate(_id)
+        if name_index is not None and collection.name == "products":
+            name_index.remove(_id)
+        if id_filter is not None:
+            id_filter.remove(_id)
+        if collection.name == "orders" and result.deleted_count:
+            _update_customer_stats(collection, [item], sign=-1)
+        return result
+
+
+@track
+def delete_many_by_ids(collection, ids, product_cache=None, name_index=None, batch_size=1000, id_filter=None):
+    """
+        Purpose: Delete many products, customers or orders by their business id
+        Notes: One delete_many with $in per batch_size ids. Orders are read first, in the same
+         batches, to take them out of customer_stats. Cache and name index entries are dropped.
+         Deleted ids are removed from the id_filter.
+        Return: dict with the number of ids "requested" and documents "deleted"
+    """
+    name = collection.name[0:-1] + "_id"
+    ids = list(dict.fromkeys(ids))
+    deleted = 0
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        if collection.name == "orders":
+            orders = list(collection.find({name: {"$in": batch}}, {"_id": 0, "order_id": 1, "customer_id": 1,
+                                                                   "v": 1, "t": 1, "total_price": 1}))
+            if not orders:
+                continue
+            result = collection.delete_many({name: {"$in": [order["order_id"] for order in orders]}})
+            # If someone else deleted some of them in between it is unknown which, the rebuild fixes the stats
+            if result.deleted_count == len(orders):
+                _update_customer_stats(collection, orders, sign=-1)
+            else:
+                logger.warning("Orders changed while deleting, run rebuild_customer_stats")
+        else:
+            result = collection.delete_many({name: {"$in": batch}})
+        deleted += result.deleted_count
+    if collection.name == "products":
+        _after_product_writes(ids, product_cache)
+        if name_index is not None:
+            for product_id in ids:
+                name_index.remove(product_id)
+    if id_filter is not None:
+        for _id in ids:
+            id_filter.remove(_id)
+    logger.info("Deleted %d of %d %s", deleted, len(ids), collection.name)
+    return {"requested": len(ids), "deleted": deleted}
+
+
+@track
+def archive_orders(orders_collection, cutoff_order_id=None, before=None, batch_size=1000, pause=0.0):
+    """
+        Purpose: Move old orders from orders to orders_archive in batches
+        Notes: Orders with order_id < cutoff_order_id and/or created before the datetime before
+         (from the ObjectId timestamp of _id) are moved, at least one cutoff is required. order_ids are
+         compared as strings ("O10" < "O2"), so cutoff_order_id only fits fixed width ids like "O00010",
+         before works for any id. Every batch is one bulk_write of upserts keyed by _id into the archive
+         and one delete_many of the same _ids, so the hot collection and its indexes shrink. If the job
+         stops between the two, the next run finds the orders again and rewrites the same archived
+         copies, so it can simply be run again. An order whose order_id is already archived under
+         another _id stays in orders and is reported in "failed". pause sleeps that many seconds between
+         batches to limit the load on live traffic. customer_stats keep counting archived orders.
+        Return: dict with the number of orders "archived", "failed" and "batches", or StoreError without a cutoff
+    """
+    query = {}
+    if cutoff_order_id is not None:
+        query["order_id"] = {"$lt": cutoff_order_id}
+    if before is not None:
+        query["_id"] = {"$lt": ObjectId.from_datetime(before)}
+    if not query:
+        return _reject(INVALID, "Error: archive_orders needs cutoff_order_id or before")
+    archive_collection = orders_collection.database[ARCHIVE_COLLECTION]
+    counts = {"archived": 0, "failed": 0, "batches": 0}
+    after = None
+    while True:
+        batch_query = query
+        if after is not None:
+            # Orders that failed stay behind, continue after them
+            batch_query = {**query, "_id": {**query.get("_id", {}), "$gt": after}}
+        orders = list(orders_collection.find(batch_query).sort("_id", pymongo.ASCENDING).limit(batch_size))
+        if not orders:
+            break
+        after = orders[-1]["_id"]
+        failed = {}
+        try:
+            # A copy left by an interrupted run has the same _id and is just replaced
+            archive_collection.bulk_write([pymongo.ReplaceOne({"_id": order["_id"]}, order, upsert=True)
+                                           for order in orders], ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            # Another order with the same order_id is already archived, this one stays in orders
+            failed = {error["index"]: error for error in e.details["writeErrors"]}
+            if len(failed) == len(orders) and any(error["code"] != 11000 for error in failed.values()):
+                raise
+        moved = [order["_id"] for index, order in enumerate(orders) if index not in failed]
+        counts["archived"] += orders_collection.delete_many({"_id": {"$in": moved}}).deleted_count
+        counts["failed"] += len(failed)
+        counts["batches"] += 1
+        for index, error in failed.items():
+            logger.warning("Order %s not archived: %s", orders[index]["order_id"], error["errmsg"])
+        logger.info("Archived %d orders", counts["archived"])
+        if pause:
+            time.sleep(pause)
+    logger.info("Archived %d orders in %d batches, %d failed", counts["archived"], counts["batches"],
+                counts["failed"])
+    return counts
+
+
+@track
+def view_one(collection, _id, product_cache=None):
     name = str(collection.name[0:-1]) + '_id'
-    item = collection.find_one({name: _id})
+    # Products can be served from the cache, cached stock may be up to ttl seconds old
+    if product_cache is not None and collection.name == "products":
+        item = product_cache.get(_id)
+    else:
+        item = collection.find_one({name: _id})
+        if item and collection.name == "orders":
+            item = normalize_order(item)
     if item:
-        print(f"{collection.name[0:-1].title()} found {item}")
+        logger.debug("%s found %s", collection.name[0:-1].title(), item)
         return item
     else:
-        print(f"No {collection.name} with id: {_id}")
+        logger.info("No %s with id: %s", collection.name, _id)
+        return StoreError(NOT_FOUND, f"No {collection.name} with id: {_id}")
+
+
+# Sort keys of find_products, "-" in front sorts descending
+PRODUCT_SORT_FIELDS = ("product_id", "name", "price", "stock")
+# Most name index matches sent to find_products as one $in, more go through the name regex
+NAME_INDEX_MAX_IDS = 1000
+
+
+@track
+def find_products(products_collection, category=None, min_price=None, max_price=None, in_stock=None,
+                  name_query=None, sort=None, limit=50, name_index=None):
+    """
+        Purpose: Catalog listing with filters, for storefront pages
+        Notes: category is an exact match, min_price/max_price an inclusive range, in_stock=True only
+         returns products with stock > 0 and False only those without. name_query matches names with
+         a word starting with every word of the query. It is answered by the in-memory name_index
+         (store_search.NameIndex) when given, else by a case-insensitive regex over the names. A query
+         matching more than NAME_INDEX_MAX_IDS products in the index also uses the regex, rather than
+         sending every match in one $in.
+         sort is one of PRODUCT_SORT_FIELDS, "-price" sorts descending, ties go by product_id in the
+         same direction. The (category, price, product_id), (category, product_id) and (price, product_id)
+         indexes serve the filters with the default and price sorts, name and stock sorts are done in memory.
+        Return: list of at most limit products without _id, StoreError for an unknown sort key
+    """
+    query = {}
+    if category is not None:
+        query["category"] = category
+    if min_price is not None or max_price is not None:
+        query["price"] = {}
+        if min_price is not None:
+            query["price"]["$gte"] = min_price
+        if max_price is not None:
+            query["price"]["$lte"] = max_price
+    if in_stock is not None:
+        query["stock"] = {"$gt": 0} if in_stock else {"$lte": 0}
+    if name_query is not None:
+        product_ids = None
+        if name_index is not None:
+            product_ids = name_index.search(name_query)
+            if not product_ids:
+                return []
+            if len(product_ids) > NAME_INDEX_MAX_IDS:
+                product_ids = None
+        if product_ids is not None:
+            query["product_id"] = {"$in": list(product_ids)}
+        else:
+            words = re.findall(r"\w+", name_query)
+            if not words:
+                return []
+            # Word prefixes like NameIndex, not anchored at the start so the index on name can't help
+            query["$and"] = [{"name": {"$regex": rf"\b{re.escape(word)}", "$options": "i"}} for word in words]
+
+    sort_keys = []
+    if sort is not None:
+        field_name = sort.lstrip("-")
+        if field_name not in PRODUCT_SORT_FIELDS:
+            return _reject(INVALID, f"Error: can't sort products by {sort}, use one of {PRODUCT_SORT_FIELDS}")
+        sort_keys.append((field_name, pymongo.DESCENDING if sort.startswith("-") else pymongo.ASCENDING))
+    if not sort_keys or sort_keys[0][0] != "product_id":
+        # Same direction as the sort, so an index can be walked backwards for "-price"
+        sort_keys.append(("product_id", sort_keys[0][1] if sort_keys else pymongo.ASCENDING))
+    cursor = products_collection.find(query, {"_id": 0}).sort(sort_keys)
+    if limit:
+        cursor = cursor.limit(limit)
+    with cursor:
+        products = list(cursor)
+    logger.debug("Found %d products", len(products))
+    return products
+
+
+def _keyset_projection(projection, sort_key):
+    """Make sure a projection returns the key used for keyset pagination"""
+    if projection is None:
         return None
+    projection = dict(projection)
+    if projection.get(sort_key, 1):
+        # Inclusion projections need the key, exclusion projections already return it
+        if any(value for field_name, value in projection.items() if field_name != "_id"):
+            projection[sort_key] = 1
+    else:
+        del projection[sort_key]
+    return projection
 
 
-def view_all(collection):
-    print(f"All {collection.name}: ")
-    items = list(collection.find())
-    for item in items:
-        print(f"{item}")
+def _decode_token(token, sort_key):
+    """Turn a page token back into the value of the sort key"""
+    if sort_key == "_id" and isinstance(token, str) and ObjectId.is_valid(token):
+        return ObjectId(token)
+    return token
+
+
+@track
+def iter_all(collection, batch_size=1000, projection=None, sort_key="_id", after=None, limit=None, query=None):
+    """
+        Purpose: Stream the documents of a collection in constant memory
+        Notes: Documents come sorted by sort_key (_id or a business id like product_id), fetched batch_size
+         at a time. after is a token from view_page, only documents with a larger sort_key are returned.
+         limit stops after that many documents. query is an optional filter.
+        Return: generator of documents
+    """
+    query = dict(query or {})
+    if after is not None:
+        query[sort_key] = {"$gt": _decode_token(after, sort_key)}
+    cursor = collection.find(query, projection).sort(sort_key, pymongo.ASCENDING).batch_size(batch_size)
+    if limit:
+        cursor = cursor.limit(limit)
+    with cursor:
+        yield from cursor
+
+
+@track
+def view_page(collection, after=None, page_size=100, projection=None, sort_key="_id", query=None):
+    """
+        Purpose: Get one page of documents with keyset pagination
+        Notes: Pass the returned token as after to get the next page. Unlike skip(), every page
+         costs the same no matter how deep it is.
+        Return: (documents, token), token is None on the last page
+    """
+    items = list(iter_all(collection, batch_size=page_size, projection=_keyset_projection(projection, sort_key),
+                          sort_key=sort_key, after=after, limit=page_size, query=query))
+    token = None
+    if len(items) == page_size:
+        token = items[-1][sort_key]
+        token = str(token) if isinstance(token, ObjectId) else token
+    return items, token
+
+
+@track
+def view_all(collection, batch_size=1000, projection=None, limit=None):
+    items = list(iter_all(collection, batch_size=batch_size, projection=projection, limit=limit))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("All %s: ", collection.name)
+        for item in items:
+            logger.debug("%s", item)
     return items
 
 
+def _hashable(value):
+    """Hashable form of a client option for the client key, e.g. the event_listeners list"""
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _hashable(item)) for key, item in value.items()))
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+
+class Store:
+    """
+        Purpose: One pooled MongoClient per process and the store operations as methods
+        Notes: The client is created lazily on first use, without a blocking round trip, and is
+         shared by every Store with the same connection settings in the same process. A child
+         process gets its own client, since MongoClient must not be shared across fork().
+         Pool settings map to the MongoClient options: max_pool_size -> maxPoolSize,
+         min_pool_size -> minPoolSize, max_idle_time_ms -> maxIdleTimeMS,
+         wait_queue_timeout_ms -> waitQueueTimeoutMS, compressors e.g. "zstd,snappy,zlib".
+         monitor=True turns on store_monitoring before the client is created.
+         name_index is a store_search.NameIndex for find_products, filled from the products on first use.
+         check_archive=True makes add_order and add_orders_bulk reject order_ids of archived orders.
+         order_filter is a store_idfilter filter of order_ids for early duplicate rejection in add_order,
+         filled with a projection-only scan on first use.
+    """
+    # (pid, settings) -> MongoClient
+    _clients = {}
+    _clients_lock = threading.Lock()
+
+    def __init__(self, host="localhost", port=27017, timeout=1000, max_pool_size=100, min_pool_size=0,
+                 max_idle_time_ms=None, wait_queue_timeout_ms=None, retry_reads=True, retry_writes=True,
+                 compressors=None, product_cache=None, name_index=None, database="online_store", monitor=False,
+                 check_archive=False, order_filter=None, **client_options):
+        if monitor:
+            store_monitoring.enable()
+        options = {"serverSelectionTimeoutMS": timeout,
+                   "maxPoolSize": max_pool_size,
+                   "minPoolSize": min_pool_size,
+                   "maxIdleTimeMS": max_idle_time_ms,
+                   "waitQueueTimeoutMS": wait_queue_timeout_ms,
+                   "retryReads": retry_reads,
+                   "retryWrites": retry_writes,
+                   "compressors": compressors}
+        options.update(client_options)
+        self.host = host
+        self.port = port
+        self.options = {key: value for key, value in options.items() if value is not None}
+        self.product_cache = product_cache
+        self.name_index = name_index
+        self.check_archive = check_archive
+        self.order_filter = order_filter
+        self.database = database
+        self._collections = None
+
+    @property
+    def client(self):
+        key = (os.getpid(), self.host, self.port,
+               tuple(sorted(((name, _hashable(value)) for name, value in self.options.items()),
+                            key=lambda item: item[0])))
+        client = Store._clients.get(key)
+        if client is None:
+            with Store._clients_lock:
+                client = Store._clients.get(key)
+                if client is None:
+                    client = pymongo.MongoClient(self.host, self.port, connect=False, **self.options)
+                    Store._clients[key] = client
+        return client
+
+    def _get_collections(self):
+        # Indexes are created once per Store, on first use
+        if self._collections is None:
+            self._collections = create_database(self.client, self.database)
+            db = self._collections[0]
+            if not db["customer_stats"].estimated_document_count() and db["orders"].estimated_document_count():
+                logger.warning("customer_stats is empty but there are orders, run: python store_admin.py rebuild-stats")
+            if self.name_index is not None and not self.name_index.loaded:
+                self.name_index.load(self._collections[1])
+            if self.order_filter is not None and not self.order_filter.loaded:
+                self.order_filter.load(self._collections[3], "order_id")
+        return self._collections
+
+    @property
+    def db(self):
+        return self._get_collections()[0]
+
+    @property
+    def products(self):
+        return self._get_collections()[1]
+
+    @property
+    def customers(self):
+        return self._get_collections()[2]
+
+    @property
+    def orders(self):
+        return self._get_collections()[3]
+
+    def ping(self):
+        """
+            Purpose: Fast health check, one ping command on a pooled connection
+            Return: True if the server answered, else False
+        """
+        try:
+            self.client.admin.command("ping")
+            return True
+        except pymongo.errors.PyMongoError as e:
+            logger.error("Error: %s", e)
+            return False
+
+    @classmethod
+    def close_all(cls):
+        """Close every client of this process"""
+        with cls._clients_lock:
+            for key in [key for key in cls._clients if key[0] == os.getpid()]:
+                cls._clients.pop(key).close()
+
+    def add_product(self, product_id, name, price, stock, category):
+        return add_product(self.products, product_id, name, price, stock, category, name_index=self.name_index)
+
+    def update_product(self, product_id, **updates):
+        return update_product(self.products, product_id, product_cache=self.product_cache, name_index=self.name_index,
+                              **updates)
+
+    def update_products_bulk(self, updates):
+        return update_products_bulk(self.products, updates, product_cache=self.product_cache,
+                                    name_index=self.name_index)
+
+    def restock(self, quantities):
+        return restock(self.products, quantities, product_cache=self.product_cache)
+
+    def reprice_category(self, category, percent):
+        return reprice_category(self.products, category, percent, product_cache=self.product_cache)
+
+    def add_customer(self, customer_id, name, email, phone, address):
+        return add_customer(self.customers, customer_id, name, email, phone, address)
+
+    def update_customer(self, customer_id, **updates):
+        return update_customer(self.customers, customer_id, **updates)
+
+    def add_order(self, order_id, customer_id, items, reserve_stock=False, use_transaction=False):
+        return add_order(self.orders, self.customers, self.products, order_id, customer_id, items,
+                         reserve_stock=reserve_stock, use_transaction=use_transaction,
+                         product_cache=self.product_cache, check_archive=self.check_archive,
+                         order_filter=self.order_filter)
+
+    def add_orders_bulk(self, orders):
+        return add_orders_bulk(self.orders, self.customers, self.products, orders, check_archive=self.check_archive,
+                               order_filter=self.order_filter)
+
+    def view_orders_by_customer(self, customer_id, batch_size=1000, limit=None):
+        return view_orders_by_customer(self.orders, customer_id, batch_size=batch_size, limit=limit)
+
+    def iter_orders_by_customer(self, customer_id, batch_size=1000, projection=None, after=None, limit=None):
+        return iter_orders_by_customer(self.orders, customer_id, batch_size=batch_size, projection=projection,
+                                       after=after, limit=limit)
+
+    def count_orders_per_customer(self, customer_ids=None, order_ids=None):
+        return count_orders_per_customer(self.orders, customer_ids, order_ids)
+
+    def total_spent_per_customer(self, customer_ids=None, order_ids=None):
+        return total_spent_per_customer(self.orders, customer_ids, order_ids)
+
+    def iter_customer_rows(self, customer_ids=None, order_ids=None, sort_by="order_count", batch_size=1000,
+                           allow_disk_use=False):
+        return iter_customer_rows(self.orders, customer_ids, order_ids, sort_by=sort_by, batch_size=batch_size,
+                                  allow_disk_use=allow_disk_use)
+
+    def order_report(self, customer_ids=None, order_ids=None, top_n=10, allow_disk_use=False):
+        return order_report(self.orders, customer_ids, order_ids, top_n=top_n, allow_disk_use=allow_disk_use)
+
+    def rebuild_customer_stats(self):
+        return rebuild_customer_stats(self.orders)
+
+    def migrate_orders(self, batch_size=1000, after=None, pause=0.0):
+        return migrate_orders(self.orders, self.products, batch_size=batch_size, after=after, pause=pause)
+
+    def delete_one(self, collection_name, _id):
+        return delete_one(self.db[collection_name], _id, product_cache=self.product_cache, name_index=self.name_index,
+                          id_filter=self.order_filter if collection_name == "orders" else None)
+
+    def delete_many_by_ids(self, collection_name, ids, batch_size=1000):
+        return delete_many_by_ids(self.db[collection_name], ids, product_cache=self.product_cache,
+                                  name_index=self.name_index, batch_size=batch_size,
+                                  id_filter=self.order_filter if collection_name == "orders" else None)
+
+    def archive_orders(self, cutoff_order_id=None, before=None, batch_size=1000, pause=0.0):
+        return archive_orders(self.orders, cutoff_order_id=cutoff_order_id, before=before, batch_size=batch_size,
+                              pause=pause)
+
+    def view_one(self, collection_name, _id):
+        return view_one(self.db[collection_name], _id, product_cache=self.product_cache)
+
+    def find_products(self, category=None, min_price=None, max_price=None, in_stock=None, name_query=None, sort=None,
+                      limit=50):
+        return find_products(self.products, category=category, min_price=min_price, max_price=max_price,
+                             in_stock=in_stock, name_query=name_query, sort=sort, limit=limit,
+                             name_index=self.name_index)
+
+    def view_all(self, collection_name, batch_size=1000, projection=None, limit=None):
+        return view_all(self.db[collection_name], batch_size=batch_size, projection=projection, limit=limit)
+
+    def iter_all(self, collection_name, batch_size=1000, projection=None, sort_key="_id", after=None, limit=None,
+                 query=None):
+        return iter_all(self.db[collection_name], batch_size=batch_size, projection=projection, sort_key=sort_key,
+                        after=after, limit=limit, query=query)
+
+    def view_page(self, collection_name, after=None, page_size=100, projection=None, sort_key="_id", query=None):
+        return view_page(self.db[collection_name], after=after, page_size=page_size, projection=projection,
+                         sort_key=sort_key, query=query)
+
+
 def main():
-    client = connect("localhost", 27017, 1000)
-    if client is None:
+    # The demo shows every message, set_quiet() or a higher level silences them
+    logging.basicConfig(level=logging.DEBUG, format="%(message)s")
+    store = Store("localhost", 27017, timeout=1000)
+    if not store.ping():
         print("Quitting...")
         return
-    db, products_collection, customers_collection, orders_collection = create_database(client)
+    db, products_collection, customers_collection, orders_collection = (store.db, store.products,
+                                                                        store.customers, store.orders)
     # For reruns
     products_collection.delete_many({})
     customers_collection.delete_many({})
     orders_collection.delete_many({})
+    db["customer_stats"].delete_many({})
+    db[ARCHIVE_COLLECTION].delete_many({})
 
     # Valid inserts
     add_product(products_collection, "P00001", "Keyboard", 499.99, 10, "Peripherals")
@@ -558,7 +1625,7 @@ def main():
     delete_one(orders_collection, 'o11')
 
     # Close the client at the end
-    client.close()
+    Store.close_all()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,77 @@
+import argparse
+import datetime
+import logging
+import sys
+
+from online_strone_database import Store
+"""
+    Maintenance commands for the online store
+    Usage: python store_admin.py rebuild-stats
+           python store_admin.py migrate-orders --batch-size 1000 [--after <_id>] [--pause 0.1]
+           python store_admin.py archive-orders --before-date 2025-01-01 --batch-size 1000 --pause 0.1
+"""
+
+
+def rebuild_stats(store, args):
+    store.rebuild_customer_stats()
+    return 0
+
+
+def migrate_orders(store, args):
+    counts = store.migrate_orders(batch_size=args.batch_size, after=args.after, pause=args.pause)
+    print(f"Migrated {counts['migrated']} orders, skipped {counts['skipped']}")
+    return 0
+
+
+def archive_orders(store, args):
+    before = None
+    if args.before_date:
+        before = datetime.datetime.fromisoformat(args.before_date)
+        if before.tzinfo is None:
+            before = before.replace(tzinfo=datetime.timezone.utc)
+    counts = store.archive_orders(cutoff_order_id=args.before_order_id, before=before, batch_size=args.batch_size,
+                                  pause=args.pause)
+    if not counts:
+        return 1
+    print(f"Archived {counts['archived']} orders in {counts['batches']} batches, {counts['failed']} failed")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Online store maintenance commands")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=27017)
+    parser.add_argument("--timeout", type=int, default=1000)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = commands.add_parser("rebuild-stats", help="recompute customer_stats from the orders")
+    rebuild.set_defaults(run=rebuild_stats)
+
+    migrate = commands.add_parser("migrate-orders", help="rewrite version 1 orders in the compact format")
+    migrate.add_argument("--batch-size", type=int, default=1000)
+    migrate.add_argument("--after", help="resume after this order _id, from the last progress message")
+    migrate.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between batches")
+    migrate.set_defaults(run=migrate_orders)
+
+    archive = commands.add_parser("archive-orders", help="move old orders to orders_archive, rerun to resume")
+    archive.add_argument("--before-order-id",
+                         help="archive orders with a smaller order_id, compared as strings: only for fixed width ids")
+    archive.add_argument("--before-date", help="archive orders created before this ISO date, UTC if no offset")
+    archive.add_argument("--batch-size", type=int, default=1000)
+    archive.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between batches")
+    archive.set_defaults(run=archive_orders)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    store = Store(args.host, args.port, timeout=args.timeout)
+    if not store.ping():
+        print("Quitting...")
+        return 1
+    try:
+        return args.run(store, args)
+    finally:
+        Store.close_all()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+"""
+    Vectorised revenue and quantity reports over a snapshot written by store_export
+    Every chunk of order lines is memory-mapped and reduced with np.bincount to per-customer
+    and per-product totals, chunks are processed in parallel by a process pool and the partial
+    totals are added up. Per-category totals come from the per-product ones. Nothing here
+    reads the database.
+    Usage: python store_analytics.py snapshot_dir --workers 8 --top 10
+"""
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("store_analytics needs NumPy: pip install numpy")
+
+
+def load_meta(directory):
+    """
+        Purpose: Read the dictionaries and counts of a snapshot
+        Return: dict from meta.json
+    """
+    with open(os.path.join(directory, "meta.json"), encoding="utf-8") as file:
+        return json.load(file)
+
+
+def chunk_directories(directory):
+    orders_directory = os.path.join(directory, "orders")
+    return [os.path.join(orders_directory, name) for name in sorted(os.listdir(orders_directory))
+            if name.startswith("chunk-")]
+
+
+def _load_column(chunk_directory, name):
+    return np.load(os.path.join(chunk_directory, name + ".npy"), mmap_mode="r")
+
+
+def chunk_totals(chunk_directory, n_customers, n_products):
+    """
+        Purpose: Reduce one chunk of order lines to per-customer and per-product totals
+        Notes: Runs in a worker process, only the small result arrays are sent back
+        Return: dict of arrays "customer_orders", "customer_quantity", "customer_revenue",
+         "product_quantity", "product_revenue"
+    """
+    order = _load_column(chunk_directory, "order")
+    customer = _load_column(chunk_directory, "customer")
+    product = _load_column(chunk_directory, "product")
+    quantity = _load_column(chunk_directory, "quantity")
+    price = _load_column(chunk_directory, "price")
+
+    # Lines of deleted products without a stored price are NaN and count as 0
+    revenue = np.nan_to_num(quantity * price)
+    # Lines of an order are next to each other, the first line of every order counts the order
+    first_lines = np.flatnonzero(np.diff(order, prepend=-1))
+    return {"customer_orders": np.bincount(customer[first_lines], minlength=n_customers),
+            "customer_quantity": np.bincount(customer, weights=quantity, minlength=n_customers),
+            "customer_revenue": np.bincount(customer, weights=revenue, minlength=n_customers),
+            "product_quantity": np.bincount(product, weights=quantity, minlength=n_products),
+            "product_revenue": np.bincount(product, weights=revenue, minlength=n_products)}
+
+
+def snapshot_totals(directory, workers=None):
+    """
+        Purpose: Per-customer and per-product totals of the whole snapshot
+        Notes: workers is the size of the process pool, None uses every CPU and 1 runs in this process
+        Return: (meta, dict of arrays like chunk_totals)
+    """
+    _require_numpy()
+    meta = load_meta(directory)
+    n_customers = meta["counts"]["customers"]
+    n_products = meta["counts"]["products"]
+    chunks = chunk_directories(directory)
+    totals = {"customer_orders": np.zeros(n_customers, dtype="int64"),
+              "customer_quantity": np.zeros(n_customers),
+              "customer_revenue": np.zeros(n_customers),
+              "product_quantity": np.zeros(n_products),
+              "product_revenue": np.zeros(n_products)}
+    if workers == 1 or len(chunks) <= 1:
+        results = (chunk_totals(chunk, n_customers, n_products) for chunk in chunks)
+        for result in results:
+            for name, values in result.items():
+                totals[name] += values
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            for result in pool.map(chunk_totals, chunks, [n_customers] * len(chunks), [n_products] * len(chunks)):
+                for name, values in result.items():
+                    totals[name] += values
+    return meta, totals
+
+
+def _rows(ids, columns, order_by, top_n):
+    """Rows sorted by a column, descending, at most top_n"""
+    order = np.argsort(-columns[order_by], kind="stable")
+    if top_n:
+        order = order[:top_n]
+    return [{"id": ids[index], **{name: values[index].item() for name, values in columns.items()}}
+            for index in order]
+
+
+def revenue_report(directory, workers=None, top_n=None):
+    """
+        Purpose: Revenue and quantities per customer, product and category from a snapshot
+        Notes: top_n limits every list to the top rows by revenue, None returns all of them
+        Return: dict with
+            "customers": [{"id", "orders", "quantity", "revenue"}]
+            "products": [{"id", "quantity", "revenue"}]
+            "categories": [{"id", "quantity", "revenue"}], id None for lines of deleted products
+            "totals": {"orders", "lines", "quantity", "revenue"}
+         lists ordered by revenue, highest first
+    """
+    meta, totals = snapshot_totals(directory, workers)
+    product_category = np.load(os.path.join(directory, "products", "category.npy"))
+    categories = meta["categories"] + [None]
+    # Category -1 (deleted product) goes to the extra last slot
+    category_index = np.where(product_category < 0, len(categories) - 1, product_category)
+    category_quantity = np.bincount(category_index, weights=totals["product_quantity"], minlength=len(categories))
+    category_revenue = np.bincount(category_index, weights=totals["product_revenue"], minlength=len(categories))
+    if not category_quantity[-1]:
+        categories, category_quantity, category_revenue = categories[:-1], category_quantity[:-1], category_revenue[:-1]
+
+    return {"customers": _rows(meta["customers"], {"orders": totals["customer_orders"],
+                                                   "quantity": totals["customer_quantity"],
+                                                   "revenue": totals["customer_revenue"]}, "revenue", top_n),
+            "products": _rows(meta["products"], {"quantity": totals["product_quantity"],
+                                                 "revenue": totals["product_revenue"]}, "revenue", top_n),
+            "categories": _rows(categories, {"quantity": category_quantity,
+                                             "revenue": category_revenue}, "revenue", top_n),
+            "totals": {"orders": meta["counts"]["orders"],
+                       "lines": meta["counts"]["lines"],
+                       "quantity": float(totals["product_quantity"].sum()),
+                       "revenue": float(totals["product_revenue"].sum())}}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Revenue report from a store_export snapshot")
+    parser.add_argument("directory")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, default every CPU")
+    parser.add_argument("--top", type=int, default=10, help="rows per list, 0 for all")
+    args = parser.parse_args(argv)
+    report = revenue_report(args.directory, workers=args.workers, top_n=args.top or None)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,354 @@
+import asyncio
+import logging
+
+import pymongo
+from bson import ObjectId
+from pymongo import AsyncMongoClient
+
+from online_strone_database import (ARCHIVE_COLLECTION, _price_items, _new_order, _keyset_projection, _decode_token,
+                                    _customer_rows_pipeline, _report_pipeline, _report_result,
+                                    normalize_order, order_total)
+from store_errors import StoreError, INVALID, NOT_FOUND, DUPLICATE
+from store_monitoring import track
+from store_validation import PRODUCT_VALIDATOR, CUSTOMER_VALIDATOR, ORDER_VALIDATOR
+"""
+    asyncio version of the store operations, on top of PyMongo's async API (pymongo >= 4.10)
+    Same validation, messages and return values as online_strone_database, so one event loop
+    can serve many requests without a thread per call.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def _reject(code, message, **details):
+    """Log a rejected operation and return its StoreError"""
+    logger.warning("%s", message)
+    return StoreError(code, message, **details)
+
+
+async def connect(host, port, timeout):
+    try:
+        client = AsyncMongoClient(host, port, serverSelectionTimeoutMS=timeout)
+        await client.server_info()
+        return client
+    except Exception as e:
+        logger.error("Error: %s", e)
+        return None
+
+
+async def create_database(client, name="online_store"):
+    db = client[name]
+    products_collection = db["products"]
+    customers_collection = db["customers"]
+    orders_collection = db["orders"]
+    # Indexes, create_index does nothing if the index already exists
+    await asyncio.gather(products_collection.create_index("product_id", unique=True),
+                         customers_collection.create_index("customer_id", unique=True),
+                         orders_collection.create_index("order_id", unique=True),
+                         db["orders_archive"].create_index("order_id", unique=True),
+                         orders_collection.create_index([("customer_id", pymongo.ASCENDING),
+                                                         ("_id", pymongo.ASCENDING)]),
+                         products_collection.create_index([("category", pymongo.ASCENDING),
+                                                           ("price", pymongo.ASCENDING),
+                                                           ("product_id", pymongo.ASCENDING)]),
+                         products_collection.create_index([("category", pymongo.ASCENDING),
+                                                           ("product_id", pymongo.ASCENDING)]),
+                         products_collection.create_index([("price", pymongo.ASCENDING),
+                                                           ("product_id", pymongo.ASCENDING)]),
+                         db["customer_stats"].create_index([("order_count", pymongo.DESCENDING),
+                                                            ("_id", pymongo.ASCENDING)]),
+                         db["customer_stats"].create_index([("total_spent", pymongo.DESCENDING),
+                                                            ("_id", pymongo.ASCENDING)]))
+    return db, products_collection, customers_collection, orders_collection
+
+
+@track
+async def add_product(products_collection, product_id, name, price, stock, category):
+    values = {"product_id": product_id,
+              "name": name,
+              "price": price,
+              "stock": stock,
+              "category": category}
+    error = PRODUCT_VALIDATOR.validate(values)
+    if error:
+        return _reject(INVALID, error)
+
+    # Prevent duplicates, product_id has a unique index
+    try:
+        result = await products_collection.insert_one(values)
+    except pymongo.errors.DuplicateKeyError:
+        return _reject(DUPLICATE, f"Error: product_id {product_id} already exists!", product_id=product_id)
+    logger.info("Added product with id %s", product_id)
+    return result
+
+
+@track
+async def add_customer(customers_collection, customer_id, name, email, phone, address):
+    """
+        Purpose: Add a new customer, same checks as online_strone_database.add_customer
+        Return: InsertOneResult if successful, else StoreError
+    """
+    values = {"customer_id": customer_id,
+              "name": name,
+              "email": email,
+              "phone": phone,
+              "address": address}
+    error = CUSTOMER_VALIDATOR.validate(values)
+    if error:
+        return _reject(INVALID, error)
+
+    # Prevent duplicates, customer_id has a unique index
+    try:
+        result = await customers_collection.insert_one(values)
+    except pymongo.errors.DuplicateKeyError:
+        return _reject(DUPLICATE, "Customer id must be unique!", customer_id=customer_id)
+    logger.info("Added customer: %s", values)
+    return result
+
+
+async def _find_products_async(products_collection, product_ids):
+    """
+        Purpose: Fetch all referenced products with a single $in query
+        Return: dict product_id -> product document
+    """
+    cursor = products_collection.find({"product_id": {"$in": list(set(product_ids))}},
+                                      {"_id": 0, "product_id": 1, "price": 1, "stock": 1})
+    return {product["product_id"]: product async for product in cursor}
+
+
+async def _change_stock(products_collection, quantities, sign=-1):
+    """
+        Purpose: Apply stock changes for many products in one bulk_write
+        Notes: sign=-1 takes the quantities out of stock, sign=1 puts them back
+        Return: BulkWriteResult, or None if there is nothing to change
+    """
+    requests = [pymongo.UpdateOne({"product_id": product_id}, {"$inc": {"stock": sign * quantity}})
+                for product_id, quantity in quantities.items() if quantity]
+    if not requests:
+        return None
+    return await products_collection.bulk_write(requests, ordered=False)
+
+
+async def _update_customer_stats(orders_collection, order, sign=1):
+    """
+        Purpose: Add an order to (sign=1) or remove it from (sign=-1) the customer_stats collection
+        Notes: Same rules as online_strone_database._update_customer_stats, removing is called after the delete
+        Return: UpdateResult
+    """
+    update = {"$inc": {"order_count": sign, "total_spent": sign * order_total(order)}}
+    stats_collection = orders_collection.database["customer_stats"]
+    if sign < 0:
+        result = await stats_collection.update_one({"_id": order["customer_id"]}, update)
+        last_filter = {"_id": order["customer_id"], "last_order_id": order["order_id"]}
+        if await stats_collection.find_one(last_filter, {"_id": 1}):
+            # The customer's latest remaining order, the archive only has older ones
+            latest = None
+            for collection in (orders_collection, orders_collection.database[ARCHIVE_COLLECTION]):
+                latest = await collection.find_one({"customer_id": order["customer_id"]}, {"_id": 0, "order_id": 1},
+                                                   sort=[("_id", pymongo.DESCENDING)])
+                if latest is not None:
+                    break
+            await stats_collection.update_one(last_filter, {"$set": {"last_order_id": latest and latest["order_id"]}})
+        return result
+    update["$set"] = {"last_order_id": order["order_id"]}
+    try:
+        result = await stats_collection.update_one({"_id": order["customer_id"]}, update, upsert=True)
+    except pymongo.errors.DuplicateKeyError:
+        # Two concurrent first orders of a customer can both try to insert its entry, retry the loser once
+        result = await stats_collection.update_one({"_id": order["customer_id"]}, update, upsert=True)
+    return result
+
+
+@track
+async def add_order(orders_collection, customers_collection, products_collection, order_id, customer_id, items,
+                    check_archive=False):
+    """
+        Purpose: Add a new order, same checks as online_strone_database.add_order
+        Notes: The customer lookup, the $in product lookup and, with check_archive=True, the archived
+         order_id lookup run concurrently, order_id uniqueness comes from the unique index
+        Return: InsertOneResult if successful, else StoreError
+    """
+    error = ORDER_VALIDATOR.validate({"order_id": order_id, "customer_id": customer_id, "items": items})
+    if error:
+        return _reject(INVALID, error)
+
+    lookups = [customers_collection.find_one({"customer_id": customer_id}, {"_id": 1}),
+               _find_products_async(products_collection, [item["product_id"] for item in items])]
+    if check_archive:
+        lookups.append(orders_collection.database[ARCHIVE_COLLECTION].find_one({"order_id": order_id}, {"_id": 1}))
+    customer, products, *archived = await asyncio.gather(*lookups)
+    # Check if customer exists
+    if not customer:
+        return _reject(NOT_FOUND, f"Error: {customer_id} doesn't exists!", customer_id=customer_id)
+    # The unique index of orders doesn't see archived orders
+    if any(archived):
+        return _reject(DUPLICATE, f"Error: order_id {order_id} already exists!", order_id=order_id)
+
+    # Check items
+    stock_left = {product_id: product["stock"] for product_id, product in products.items()}
+    lines, total, quantities, error = _price_items(items, products, stock_left)
+    if error is not None:
+        logger.warning("%s", error)
+        return error
+
+    # Reduce stock
+    await _change_stock(products_collection, quantities)
+
+    order = _new_order(order_id, customer_id, lines, total)
+    # Check if order exists, order_id has a unique index
+    try:
+        result = await orders_collection.insert_one(order)
+    except pymongo.errors.DuplicateKeyError:
+        await _change_stock(products_collection, quantities, sign=1)
+        return _reject(DUPLICATE, f"Error: order_id {order_id} already exists!", order_id=order_id)
+    await _update_customer_stats(orders_collection, order)
+    logger.info("Added order %s for customer %s", order_id, customer_id)
+    return result
+
+
+@track
+async def iter_all(collection, batch_size=1000, projection=None, sort_key="_id", after=None, limit=None, query=None):
+    """
+        Purpose: Stream the documents of a collection in constant memory
+        Notes: Same parameters as online_strone_database.iter_all
+        Return: async generator of documents
+    """
+    query = dict(query or {})
+    if after is not None:
+        query[sort_key] = {"$gt": _decode_token(after, sort_key)}
+    cursor = collection.find(query, projection).sort(sort_key, pymongo.ASCENDING).batch_size(batch_size)
+    if limit:
+        cursor = cursor.limit(limit)
+    try:
+        async for item in cursor:
+            yield item
+    finally:
+        await cursor.close()
+
+
+@track
+async def view_page(collection, after=None, page_size=100, projection=None, sort_key="_id", query=None):
+    """
+        Purpose: Get one page of documents with keyset pagination
+        Return: (documents, token), token is None on the last page
+    """
+    items = [item async for item in iter_all(collection, batch_size=page_size,
+                                             projection=_keyset_projection(projection, sort_key),
+                                             sort_key=sort_key, after=after, limit=page_size, query=query)]
+    token = None
+    if len(items) == page_size:
+        token = items[-1][sort_key]
+        token = str(token) if isinstance(token, ObjectId) else token
+    return items, token
+
+
+@track
+async def view_orders_by_customer(orders_collection, customer_id, batch_size=1000, limit=None):
+    orders = [normalize_order(order) async for order in iter_all(orders_collection, batch_size=batch_size,
+                                                                 projection={'_id': 0}, limit=limit,
+                                                                 query={"customer_id": customer_id})]
+    if not orders:
+        logger.info("No orders for customer with id %s", customer_id)
+        return StoreError(NOT_FOUND, f"No orders for customer with id {customer_id}", customer_id=customer_id)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Orders of customer with id %s:", customer_id)
+        for order in orders:
+            logger.debug("%s", order)
+    return orders
+
+
+async def iter_customer_rows(orders_collection, customer_ids=None, order_ids=None, sort_by="order_count",
+                             batch_size=1000, allow_disk_use=False):
+    """
+        Purpose: Stream the order report rows, one per customer, sort_by highest first
+        Notes: Same parameters and rows as online_strone_database.iter_customer_rows
+        Return: async generator of {"customer_id", "order_count", "total_spent", "average_order"}
+    """
+    collection_name, pipeline = _customer_rows_pipeline(customer_ids, order_ids, sort_by)
+    cursor = await orders_collection.database[collection_name].aggregate(pipeline, allowDiskUse=allow_disk_use,
+                                                                         batchSize=batch_size)
+    async for row in cursor:
+        yield row
+
+
+@track
+async def order_report(orders_collection, customer_ids=None, order_ids=None, top_n=10, allow_disk_use=False):
+    """
+        Purpose: Totals and top customers by spend in one aggregation
+        Notes: Same parameters and result as online_strone_database.order_report
+        Return: dict with "top_customers" and "totals"
+    """
+    collection_name, pipeline = _report_pipeline(customer_ids, order_ids, top_n)
+    cursor = await orders_collection.database[collection_name].aggregate(pipeline, allowDiskUse=allow_disk_use)
+    facets = await cursor.next()
+    top_customers = None
+    if not top_n:
+        top_customers = [row async for row in iter_customer_rows(orders_collection, customer_ids, order_ids,
+                                                                 "total_spent", allow_disk_use=allow_disk_use)]
+    return _report_result(facets, top_customers)
+
+
+@track
+async def count_orders_per_customer(orders_collection, customer_ids=None, order_ids=None):
+    customers = []
+    log = logger.isEnabledFor(logging.INFO)
+    if log:
+        logger.info("Number of orders per customer: ")
+    async for result in iter_customer_rows(orders_collection, customer_ids, order_ids, "order_count"):
+        if log:
+            logger.info("%s : %d", result["customer_id"], result["order_count"])
+        customers.append(result)
+    return customers
+
+
+@track
+async def total_spent_per_customer(orders_collection, customer_ids=None, order_ids=None):
+    customers = []
+    log = logger.isEnabledFor(logging.INFO)
+    if log:
+        logger.info("Total spent per customer: ")
+    async for result in iter_customer_rows(orders_collection, customer_ids, order_ids, "total_spent"):
+        if log:
+            logger.info("%s : %.2f", result["customer_id"], result["total_spent"])
+        customers.append(result)
+    return customers
+
+
+@track
+async def delete_one(collection, _id):
+    # Check if exists
+    name = str(collection.name[0:-1])
+    item = await collection.find_one({name + "_id": _id})
+    if not item:
+        return _reject(NOT_FOUND, f"No {name} with {name}_id {_id}")
+    else:
+        logger.info("Deleting %s with %s_id %s", name, name, _id)
+        result = await collection.delete_one({name + "_id": _id})
+        if collection.name == "orders" and result.deleted_count:
+            await _update_customer_stats(collection, item, sign=-1)
+        return result
+
+
+@track
+async def view_one(collection, _id):
+    name = str(collection.name[0:-1]) + '_id'
+    item = await collection.find_one({name: _id})
+    if item and collection.name == "orders":
+        item = normalize_order(item)
+    if item:
+        logger.debug("%s found %s", collection.name[0:-1].title(), item)
+        return item
+    else:
+        logger.info("No %s with id: %s", collection.name, _id)
+        return StoreError(NOT_FOUND, f"No {collection.name} with id: {_id}")
+
+
+@track
+async def view_all(collection, batch_size=1000, projection=None, limit=None):
+    items = [item async for item in iter_all(collection, batch_size=batch_size, projection=projection, limit=limit)]
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("All %s: ", collection.name)
+        for item in items:
+            logger.debug("%s", item)
+    return items
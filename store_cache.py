@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import OrderedDict
+"""
+    Read-through cache of product documents for add_order and view_one
+    Entries are evicted when they are older than ttl seconds or, least recently used first,
+    when there are more than max_size of them. Cached stock is only informative: add_order
+    still enforces stock with a conditional update when it uses the cache.
+"""
+
+
+class ProductCache:
+    """
+        Purpose: Size-bounded LRU cache with TTL of product documents, keyed by product_id
+        Notes: Safe to share between threads. update_product and delete_one invalidate entries
+         when they are given the cache.
+    """
+
+    def __init__(self, products_collection, max_size=1024, ttl=60.0):
+        self.products_collection = products_collection
+        self.max_size = max_size
+        self.ttl = ttl
+        # product_id -> (expiry time, product), oldest use first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, product_id, now):
+        """Return the cached product or None, dropping it if it expired. Call with the lock held."""
+        entry = self._entries.get(product_id)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del self._entries[product_id]
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(product_id)
+        return entry[1]
+
+    def _store(self, product, now):
+        """Cache a product, evicting the least recently used entries. Call with the lock held."""
+        self._entries[product["product_id"]] = (now + self.ttl, product)
+        self._entries.move_to_end(product["product_id"])
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, product_id):
+        """
+            Purpose: Get one product, from the cache or from MongoDB on a miss
+            Return: product document, or None if there is no such product
+        """
+        return self.get_many([product_id]).get(product_id)
+
+    def get_many(self, product_ids):
+        """
+            Purpose: Get many products, all misses are fetched with one $in query
+            Return: dict product_id -> product document, products that don't exist are left out
+        """
+        products = {}
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            for product_id in set(product_ids):
+                product = self._lookup(product_id, now)
+                if product is None:
+                    self.misses += 1
+                    missing.append(product_id)
+                else:
+                    self.hits += 1
+                    products[product_id] = product
+        if missing:
+            fetched = list(self.products_collection.find({"product_id": {"$in": missing}}))
+            now = time.monotonic()
+            with self._lock:
+                for product in fetched:
+                    self._store(product, now)
+                    products[product["product_id"]] = product
+        return products
+
+    def invalidate(self, product_id):
+        """Drop one product from the cache"""
+        with self._lock:
+            self._entries.pop(product_id, None)
+
+    def clear(self):
+        """Drop every product from the cache"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+            Purpose: Cache counters
+            Return: dict with hits, misses, evictions, size and hit_rate
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "size": len(self._entries),
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,57 @@
+import logging
+"""
+    Results and logging of the store operations
+    Failed operations return a StoreError instead of printing a message and returning None.
+    A StoreError is falsy, so existing `if not result:` checks keep working, and it carries a
+    machine readable code next to the message. Messages go through the standard logging module:
+    successes at INFO, per-document output of the view functions at DEBUG, rejections at WARNING.
+"""
+
+INVALID = "invalid"
+NOT_FOUND = "not_found"
+DUPLICATE = "duplicate"
+INSUFFICIENT_STOCK = "insufficient_stock"
+FAILED = "failed"
+
+# Loggers of the store modules, set_quiet changes all of them. Slow operation warnings of store_monitoring stay on
+STORE_LOGGERS = ("online_strone_database", "store_async", "store_import", "store_export", "store_inventory")
+
+
+class StoreError:
+    """
+        Purpose: Structured result of a rejected or failed store operation
+        Notes: code is one of INVALID, NOT_FOUND, DUPLICATE, INSUFFICIENT_STOCK, FAILED,
+         message is the text that used to be printed, details holds e.g. the product_id.
+    """
+    __slots__ = ("code", "message", "details")
+
+    def __init__(self, code, message, **details):
+        self.code = code
+        self.message = message
+        self.details = details
+
+    def __bool__(self):
+        return False
+
+    def __str__(self):
+        return self.message
+
+    def __repr__(self):
+        return f"StoreError({self.code!r}, {self.message!r})"
+
+    def __eq__(self, other):
+        return isinstance(other, StoreError) and (self.code, self.message) == (other.code, other.message)
+
+    __hash__ = None
+
+    def as_dict(self):
+        return {"code": self.code, "message": self.message, **self.details}
+
+
+def set_quiet(quiet=True):
+    """
+        Purpose: Quiet/production mode, only errors of the store modules are logged
+        Notes: Rejections are still returned as StoreError, quiet=False restores the default level
+    """
+    for name in STORE_LOGGERS:
+        logging.getLogger(name).setLevel(logging.ERROR if quiet else logging.NOTSET)
@@ -0,0 +1,182 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+from array import array
+
+from online_strone_database import ARCHIVE_COLLECTION, Store, iter_all, normalize_order
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+"""
+    Columnar snapshots of the orders and products for offline analytics
+    Orders are flattened to one row per order line and written in chunks of NumPy arrays
+    (.npy, read back memory-mapped), so reports over tens of millions of lines don't touch
+    the primary database. String ids are replaced with integer codes, the code -> id
+    dictionaries are stored in meta.json.
+    Layout of a snapshot directory:
+        meta.json                       dictionaries, counts and creation time
+        products/{category,price,stock}.npy        one row per product code
+        orders/chunk-00000/{order,customer,product,quantity,price}.npy   one row per order line
+    Usage: python store_export.py snapshot_dir --chunk-lines 1000000
+    NumPy is optional for the store, it is only needed here and in store_analytics.
+"""
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+# Line columns: (name, array typecode, NumPy dtype)
+LINE_COLUMNS = (("order", "q", "int64"),
+                ("customer", "i", "int32"),
+                ("product", "i", "int32"),
+                ("quantity", "i", "int32"),
+                ("price", "d", "float64"))
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("store_export needs NumPy: pip install numpy")
+
+
+class _Codes:
+    """Dictionary encoding of string ids, codes are given in order of first appearance"""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+def _write_columns(directory, columns):
+    os.makedirs(directory, exist_ok=True)
+    for name, typecode, dtype in LINE_COLUMNS:
+        np.save(os.path.join(directory, name + ".npy"), np.frombuffer(columns[name], dtype=dtype))
+
+
+def _iter_orders(db, batch_size, include_archive):
+    """Orders, then the archived orders, each collection streamed with a keyset-ordered cursor"""
+    projection = {"_id": 0, "order_id": 1, "customer_id": 1, "items": 1, "v": 1, "l": 1, "t": 1}
+    collection_names = ("orders", ARCHIVE_COLLECTION) if include_archive else ("orders",)
+    for collection_name in collection_names:
+        yield from iter_all(db[collection_name], batch_size=batch_size, projection=projection)
+
+
+def export_snapshot(db, directory, chunk_lines=1_000_000, batch_size=5000, include_archive=True):
+    """
+        Purpose: Stream products and orders into a columnar snapshot directory
+        Notes: The collections are read once with keyset-ordered cursors in constant memory,
+         apart from the id dictionaries. A chunk is closed after chunk_lines lines, but never in
+         the middle of an order, so every order is in exactly one chunk. Orders of both versions
+         are read, lines of version 1 orders have no stored price and are valued at the product's
+         current price. Products referenced by orders but no
+         longer in the catalog get category -1 and price NaN. Archived orders are exported after
+         the others, include_archive=False leaves them out.
+        Return: dict with the number of "products", "customers", "orders", "lines" and "chunks"
+    """
+    _require_numpy()
+    os.makedirs(os.path.join(directory, "orders"), exist_ok=True)
+    product_codes = _Codes()
+    category_codes = _Codes()
+    customer_codes = _Codes()
+    categories = array("i")
+    prices = array("d")
+    stocks = array("q")
+
+    # Products first, the order lines need their codes and prices
+    for product in iter_all(db["products"], batch_size=batch_size,
+                            projection={"_id": 0, "product_id": 1, "price": 1, "stock": 1, "category": 1}):
+        product_codes.code(product["product_id"])
+        categories.append(category_codes.code(product.get("category")))
+        prices.append(float(product.get("price", float("nan"))))
+        stocks.append(int(product.get("stock", 0)))
+
+    counts = {"orders": 0, "lines": 0, "chunks": 0}
+    columns = {name: array(typecode) for name, typecode, dtype in LINE_COLUMNS}
+
+    def flush():
+        _write_columns(os.path.join(directory, "orders", f"chunk-{counts['chunks']:05d}"), columns)
+        counts["chunks"] += 1
+        for name, typecode, dtype in LINE_COLUMNS:
+            columns[name] = array(typecode)
+
+    for order in _iter_orders(db, batch_size, include_archive):
+        order = normalize_order(order)
+        order_code = counts["orders"]
+        customer_code = customer_codes.code(order["customer_id"])
+        for item in order["items"]:
+            product_code = product_codes.code(item["product_id"])
+            if product_code == len(prices):
+                # Deleted product
+                categories.append(-1)
+                prices.append(float("nan"))
+                stocks.append(0)
+            columns["order"].append(order_code)
+            columns["customer"].append(customer_code)
+            columns["product"].append(product_code)
+            columns["quantity"].append(item["quantity"])
+            columns["price"].append(float(item.get("price", prices[product_code])))
+        counts["orders"] += 1
+        counts["lines"] += len(order["items"])
+        if len(columns["order"]) >= chunk_lines:
+            flush()
+    if len(columns["order"]) or not counts["chunks"]:
+        flush()
+
+    products_directory = os.path.join(directory, "products")
+    os.makedirs(products_directory, exist_ok=True)
+    np.save(os.path.join(products_directory, "category.npy"), np.frombuffer(categories, dtype="int32"))
+    np.save(os.path.join(products_directory, "price.npy"), np.frombuffer(prices, dtype="float64"))
+    np.save(os.path.join(products_directory, "stock.npy"), np.frombuffer(stocks, dtype="int64"))
+
+    counts["products"] = len(product_codes.values)
+    counts["customers"] = len(customer_codes.values)
+    meta = {"format_version": FORMAT_VERSION,
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "counts": counts,
+            "products": product_codes.values,
+            "categories": category_codes.values,
+            "customers": customer_codes.values}
+    # meta.json is written last, a directory without it is an unfinished export
+    with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as file:
+        json.dump(meta, file)
+    logger.info("Exported %d orders with %d lines in %d chunks and %d products",
+                counts["orders"], counts["lines"], counts["chunks"], counts["products"])
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export orders and products to a columnar NumPy snapshot")
+    parser.add_argument("directory")
+    parser.add_argument("--chunk-lines", type=int, default=1_000_000)
+    parser.add_argument("--skip-archive", action="store_true", help="leave out the orders in orders_archive")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=27017)
+    parser.add_argument("--timeout", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    store = Store(args.host, args.port, timeout=args.timeout)
+    if not store.ping():
+        print("Quitting...")
+        return 1
+    try:
+        counts = export_snapshot(store.db, args.directory, chunk_lines=args.chunk_lines,
+                                 include_archive=not args.skip_archive)
+    finally:
+        Store.close_all()
+    print(f"Exported {counts['orders']} orders ({counts['lines']} lines, {counts['chunks']} chunks) "
+          f"and {counts['products']} products to {args.directory}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
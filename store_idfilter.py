@@ -0,0 +1,212 @@
+import abc
+import hashlib
+import math
+import threading
+"""
+    In-process existence filters of order_ids for early duplicate rejection in add_order
+    A filter answers "certainly not stored" or "possibly stored". add_order and add_orders_bulk look
+    up the possible hits before taking stock, so a duplicate order_id is rejected without reserving
+    stock and giving it back. A miss saves nothing: without a filter there is no order_id lookup
+    either, the unique index rejects the duplicate on insert. The filter costs one lookup per
+    possible hit, false positives included, in exchange for those early rejections.
+    A filter only knows the ids written through the functions it is given to: ids written by another
+    process, store_async or an import are misses here, and are still rejected by the unique index.
+    A miss is never proof that an id doesn't exist.
+    BloomFilter is a fixed size bit array, about 1.2 bytes per id at a 1% false positive rate, for
+    tens of millions of ids. It can't forget ids, so deleted ids stay possible hits. IdSet is an
+    exact set, with no false positives but a Python object per id.
+"""
+
+
+class _IdFilter(abc.ABC):
+    """
+        Purpose: Counters and seeding shared by the filters
+        Notes: checks counts might_contain calls, misses the definite misses and possible_hits the
+         rest. A possible hit is looked up in MongoDB: a stored id is reported with duplicate(),
+         one that wasn't found with false_positive().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.checks = 0
+        self.misses = 0
+        self.possible_hits = 0
+        self.duplicates = 0
+        self.false_positives = 0
+
+    @abc.abstractmethod
+    def _add(self, _id):
+        pass
+
+    @abc.abstractmethod
+    def _contains(self, _id):
+        pass
+
+    def _remove(self, _id):
+        pass
+
+    @abc.abstractmethod
+    def _clear(self):
+        pass
+
+    def load(self, collection, field, batch_size=5000):
+        """
+            Purpose: Fill the filter from a projection-only scan of one field of the collection
+            Notes: Ids added or removed while the scan runs are kept or may stay possible hits,
+             never turned into misses
+            Return: number of ids read
+        """
+        with self._lock:
+            self._clear()
+        count = 0
+        batch = []
+        cursor = collection.find({}, {"_id": 0, field: 1}).batch_size(batch_size)
+        with cursor:
+            for document in cursor:
+                if field in document:
+                    batch.append(document[field])
+                if len(batch) >= batch_size:
+                    count += self._add_batch(batch)
+                    batch = []
+        count += self._add_batch(batch)
+        self.loaded = True
+        return count
+
+    def _add_batch(self, ids):
+        with self._lock:
+            for _id in ids:
+                self._add(_id)
+        return len(ids)
+
+    def add(self, _id):
+        with self._lock:
+            self._add(_id)
+
+    def remove(self, _id):
+        """Forget an id, a BloomFilter keeps it as a possible hit"""
+        with self._lock:
+            self._remove(_id)
+
+    def might_contain(self, _id):
+        """
+            Return: False if the id is certainly not stored, True if it may be
+        """
+        with self._lock:
+            found = self._contains(_id)
+            self.checks += 1
+            if found:
+                self.possible_hits += 1
+            else:
+                self.misses += 1
+        return found
+
+    def duplicate(self, count=1):
+        """Report possible hits that were stored, rejected before taking stock"""
+        with self._lock:
+            self.duplicates += count
+
+    def false_positive(self, count=1):
+        """Report possible hits that turned out not to be stored"""
+        with self._lock:
+            self.false_positives += count
+
+    def stats(self):
+        """
+            Purpose: Filter counters for sizing
+            Return: dict with checks, misses, possible_hits, duplicates (rejected early), false_positives
+             (lookups that found nothing) and false_positive_rate (share of absent ids let through)
+        """
+        with self._lock:
+            absent = self.misses + self.false_positives
+            return {"checks": self.checks,
+                    "misses": self.misses,
+                    "possible_hits": self.possible_hits,
+                    "duplicates": self.duplicates,
+                    "false_positives": self.false_positives,
+                    "false_positive_rate": self.false_positives / absent if absent else 0.0}
+
+
+class BloomFilter(_IdFilter):
+    """
+        Purpose: Bloom filter of ids sized for capacity ids at error_rate false positives
+        Notes: Positions come from one blake2b digest by double hashing. Past capacity the false
+         positive rate grows, stats() shows the rate expected from the bits set so far.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        super().__init__()
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = self.bits_for(capacity, error_rate)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self._count = 0
+
+    @staticmethod
+    def bits_for(capacity, error_rate):
+        """Number of bits for capacity ids at error_rate, e.g. 10 million ids at 1% take about 12 MB"""
+        return max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+
+    def _positions(self, _id):
+        digest = hashlib.blake2b(str(_id).encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        # Odd step, so the positions don't repeat
+        step = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+
+    def _add(self, _id):
+        for position in self._positions(_id):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self._count += 1
+
+    def _contains(self, _id):
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(_id))
+
+    def _clear(self):
+        self._bits = bytearray(len(self._bits))
+        self._count = 0
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            fill = int.from_bytes(self._bits, "little").bit_count() / self.size
+            stats.update({"added": self._count,
+                          "capacity": self.capacity,
+                          "memory_bytes": len(self._bits),
+                          "fill": fill,
+                          "expected_false_positive_rate": fill ** self.hashes})
+        return stats
+
+
+class IdSet(_IdFilter):
+    """
+        Purpose: Exact set of ids, a possible hit is always a stored id unless it was written elsewhere
+        Notes: Forgets deleted ids, memory grows with the ids (roughly 100 bytes per string id)
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._ids = set()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _add(self, _id):
+        self._ids.add(_id)
+
+    def _contains(self, _id):
+        return _id in self._ids
+
+    def _remove(self, _id):
+        self._ids.discard(_id)
+
+    def _clear(self):
+        self._ids = set()
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats["size"] = len(self._ids)
+        return stats
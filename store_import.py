@@ -0,0 +1,177 @@
+import argparse
+import csv
+import itertools
+import json
+import logging
+import os
+import sys
+
+import pymongo
+
+from online_strone_database import Store
+from store_errors import INVALID, DUPLICATE, FAILED
+from store_validation import PRODUCT_VALIDATOR, CUSTOMER_VALIDATOR
+"""
+    Bulk import of products and customers from CSV or JSONL files
+    Rows are streamed in fixed-size chunks, so memory stays the same for any file size.
+    Every row is validated with the same rules as add_product/add_customer and each chunk
+    is written with one unordered insert_many. Rejected rows go to a JSONL report.
+    Usage: python store_import.py products catalog.csv --chunk-size 5000 --report rejected.jsonl
+"""
+
+logger = logging.getLogger(__name__)
+
+# Fields of every kind of record and how to convert CSV text to the expected type
+KINDS = {
+    "products": {"fields": {"product_id": str,
+                            "name": str,
+                            "price": float,
+                            "stock": int,
+                            "category": str},
+                 "validator": PRODUCT_VALIDATOR,
+                 "key": "product_id"},
+    "customers": {"fields": {"customer_id": str,
+                             "name": str,
+                             "email": str,
+                             "phone": str,
+                             "address": str},
+                  "validator": CUSTOMER_VALIDATOR,
+                  "key": "customer_id"},
+}
+
+
+def _read_csv(file, fields):
+    """
+        Purpose: Stream CSV rows as records, converting text to the expected types
+        Return: generator of (line, record, error), error is None if the row could be read
+    """
+    reader = csv.DictReader(file)
+    for row in reader:
+        record = {}
+        error = None
+        for field_name, convert in fields.items():
+            value = row.get(field_name)
+            if value is not None and convert is not str:
+                try:
+                    value = convert(value)
+                except ValueError:
+                    error = f"Field {field_name} should be of type {convert}"
+                    break
+            record[field_name] = value
+        yield reader.line_num, record, error
+
+
+def _read_jsonl(file, fields):
+    """
+        Purpose: Stream JSONL rows as records, one JSON object per line
+        Return: generator of (line, record, error), error is None if the row could be read
+    """
+    for line, text in enumerate(file, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except json.JSONDecodeError as e:
+            yield line, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(row, dict):
+            yield line, None, "Each line must be a JSON object"
+            continue
+        yield line, {field_name: row.get(field_name) for field_name in fields}, None
+
+
+def import_file(collection, kind, path, file_format=None, chunk_size=1000, report=None):
+    """
+        Purpose: Import products or customers from a CSV or JSONL file
+        Notes: kind is "products" or "customers". file_format is "csv" or "jsonl", by default it comes
+         from the file extension. report is an open text file, every rejected row is written to it
+         as a JSON line {"line", "id", "code", "error"}, code is a store_errors code.
+         Duplicates are reported by the unique index.
+        Return: dict with the number of rows "read", "inserted" and "rejected"
+    """
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of {list(KINDS)}")
+    fields = KINDS[kind]["fields"]
+    validator = KINDS[kind]["validator"]
+    key = KINDS[kind]["key"]
+    if file_format is None:
+        file_format = "csv" if os.path.splitext(path)[1].lower() == ".csv" else "jsonl"
+    read = _read_csv if file_format == "csv" else _read_jsonl
+
+    counts = {"read": 0, "inserted": 0, "rejected": 0}
+
+    def reject(line, record, code, error):
+        counts["rejected"] += 1
+        if report is not None:
+            report.write(json.dumps({"line": line, "id": (record or {}).get(key), "code": code,
+                                     "error": error}) + "\n")
+
+    with open(path, newline="", encoding="utf-8") as file:
+        rows = read(file, fields)
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            counts["read"] += len(chunk)
+            errors = iter(validator.validate_many([record for line, record, error in chunk if error is None]))
+            documents = []
+            lines = []
+            for line, record, error in chunk:
+                if error is None:
+                    error = next(errors)
+                if error:
+                    reject(line, record, INVALID, error)
+                    continue
+                documents.append(record)
+                lines.append(line)
+            if not documents:
+                continue
+            try:
+                result = collection.insert_many(documents, ordered=False)
+                counts["inserted"] += len(result.inserted_ids)
+            except pymongo.errors.BulkWriteError as e:
+                counts["inserted"] += e.details["nInserted"]
+                for write_error in e.details["writeErrors"]:
+                    record = documents[write_error["index"]]
+                    if write_error["code"] == 11000:
+                        code, error = DUPLICATE, f"Error: {key} {record[key]} already exists!"
+                    else:
+                        code, error = FAILED, write_error["errmsg"]
+                    reject(lines[write_error["index"]], record, code, error)
+            logger.debug("Imported %d of %d %s rows", counts["inserted"], counts["read"], kind)
+    logger.info("Read %d %s, inserted %d, rejected %d", counts["read"], kind, counts["inserted"], counts["rejected"])
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import products or customers from a CSV or JSONL file")
+    parser.add_argument("kind", choices=list(KINDS))
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["csv", "jsonl"], dest="file_format")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--report", help="write rejected rows to this JSONL file")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=27017)
+    parser.add_argument("--timeout", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    store = Store(args.host, args.port, timeout=args.timeout)
+    if not store.ping():
+        print("Quitting...")
+        return 1
+    collection = store.products if args.kind == "products" else store.customers
+
+    report = open(args.report, "w", encoding="utf-8") if args.report else None
+    try:
+        counts = import_file(collection, args.kind, args.path, file_format=args.file_format,
+                             chunk_size=args.chunk_size, report=report)
+    finally:
+        if report is not None:
+            report.close()
+        Store.close_all()
+    print(f"Read {counts['read']} {args.kind}, inserted {counts['inserted']}, rejected {counts['rejected']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
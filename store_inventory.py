@@ -0,0 +1,192 @@
+import logging
+import threading
+import time
+
+import pymongo
+"""
+    In-memory inventory snapshot of product_id -> stock and price
+    The whole products collection is loaded once, then a change stream on products keeps the
+    snapshot current, so availability reads ("in stock" badges) never touch MongoDB.
+    The stream is opened before the load, so no change between the two is lost; replayed events
+    are harmless because every event carries the product's current document (updateLookup).
+    If the stream breaks it is resumed from the last resume token, and if that is no longer
+    possible (oplog rolled over, collection dropped) the snapshot is reloaded.
+    Change streams need a replica set, a single node one is enough for development:
+        mongod --replSet rs0 --dbpath /tmp/rs0 --port 27017
+        mongosh --eval 'rs.initiate()'
+    Usage:
+        inventory = InventorySnapshot(store.products)
+        inventory.start()
+        inventory.in_stock("P00001", quantity=2)
+        inventory.stop()
+"""
+
+logger = logging.getLogger(__name__)
+
+# Changes to products and the events that end a change stream
+CHANGE_PIPELINE = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete", "invalidate",
+                                                         "drop", "rename", "dropDatabase"]}}}]
+# Events after which the stream can't continue
+END_EVENTS = ("invalidate", "drop", "rename", "dropDatabase")
+
+
+class InventorySnapshot:
+    """
+        Purpose: Stock and price of every product in memory, kept current by a change stream
+        Notes: Lookups are dict reads without a lock or a round trip. A background thread applies
+         the changes; until start() returns the snapshot is empty. retry_delay is the pause before
+         reconnecting after a network error.
+    """
+
+    def __init__(self, products_collection, max_await_ms=1000, retry_delay=1.0):
+        self.products_collection = products_collection
+        self.max_await_ms = max_await_ms
+        self.retry_delay = retry_delay
+        # product_id -> (stock, price)
+        self._products = {}
+        # _id -> product_id, delete events only have the _id
+        self._product_ids = {}
+        self._resume_token = None
+        self._stream = None
+        self._thread = None
+        self._stop = threading.Event()
+        self.loads = 0
+        self.resumes = 0
+        self.events = 0
+        self.last_event_at = None
+
+    def __len__(self):
+        return len(self._products)
+
+    def _open_stream(self, resume_after=None):
+        return self.products_collection.watch(CHANGE_PIPELINE, full_document="updateLookup",
+                                              resume_after=resume_after, max_await_time_ms=self.max_await_ms)
+
+    def _load(self):
+        """Open a new stream, then read every product into a new snapshot"""
+        if self._stream is not None:
+            self._stream.close()
+        self._stream = self._open_stream()
+        products = {}
+        product_ids = {}
+        cursor = self.products_collection.find({}, {"product_id": 1, "stock": 1, "price": 1}).batch_size(5000)
+        with cursor:
+            for product in cursor:
+                products[product["product_id"]] = (product.get("stock", 0), product.get("price"))
+                product_ids[product["_id"]] = product["product_id"]
+        # Swapped in one step, readers see the old or the new snapshot
+        self._products = products
+        self._product_ids = product_ids
+        self._resume_token = self._stream.resume_token
+        self.loads += 1
+        logger.info("Loaded inventory of %d products", len(products))
+
+    def _apply(self, change):
+        """Apply one change stream event, return False if the stream ended"""
+        operation = change["operationType"]
+        if operation in END_EVENTS:
+            return False
+        _id = change["documentKey"]["_id"]
+        product = change.get("fullDocument")
+        if operation == "delete" or product is None:
+            # With updateLookup a product deleted right after an update has no document any more
+            product_id = self._product_ids.pop(_id, None)
+            if product_id is not None:
+                self._products.pop(product_id, None)
+        else:
+            old_product_id = self._product_ids.get(_id)
+            if old_product_id is not None and old_product_id != product["product_id"]:
+                self._products.pop(old_product_id, None)
+            self._product_ids[_id] = product["product_id"]
+            self._products[product["product_id"]] = (product.get("stock", 0), product.get("price"))
+        self.events += 1
+        self.last_event_at = time.time()
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                change = self._stream.try_next()
+                if change is not None and not self._apply(change):
+                    logger.warning("Change stream ended with %s, reloading the inventory", change["operationType"])
+                    self._load()
+                    continue
+                self._resume_token = self._stream.resume_token
+            except pymongo.errors.OperationFailure as e:
+                # E.g. the resume point is no longer in the oplog
+                logger.warning("Change stream failed (%s), reloading the inventory", e)
+                self._reload_until_done()
+            except pymongo.errors.PyMongoError as e:
+                logger.warning("Change stream interrupted (%s), resuming", e)
+                self._stop.wait(self.retry_delay)
+                self._resume()
+
+    def _resume(self):
+        try:
+            self._stream.close()
+            self._stream = self._open_stream(resume_after=self._resume_token)
+            self.resumes += 1
+        except pymongo.errors.OperationFailure as e:
+            logger.warning("Can't resume the change stream (%s), reloading the inventory", e)
+            self._reload_until_done()
+        except pymongo.errors.PyMongoError as e:
+            logger.warning("Can't resume the change stream yet: %s", e)
+
+    def _reload_until_done(self):
+        while not self._stop.is_set():
+            try:
+                self._load()
+                return
+            except pymongo.errors.PyMongoError as e:
+                logger.warning("Inventory reload failed (%s), retrying", e)
+                self._stop.wait(self.retry_delay)
+
+    def start(self):
+        """Load the snapshot and start following the changes, returns when the snapshot is loaded"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._load()
+        self._thread = threading.Thread(target=self._run, name="inventory-snapshot", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def get(self, product_id):
+        """
+            Return: {"stock", "price"} of the product, or None if there is no such product
+        """
+        entry = self._products.get(product_id)
+        return None if entry is None else {"stock": entry[0], "price": entry[1]}
+
+    def get_many(self, product_ids):
+        """
+            Return: dict product_id -> {"stock", "price"}, products that don't exist are left out
+        """
+        products = self._products
+        found = {}
+        for product_id in product_ids:
+            # One read per id, the change thread may remove it at any time
+            entry = products.get(product_id)
+            if entry is not None:
+                found[product_id] = {"stock": entry[0], "price": entry[1]}
+        return found
+
+    def in_stock(self, product_id, quantity=1):
+        """Whether the product has at least quantity in stock, informative only: add_order still checks"""
+        entry = self._products.get(product_id)
+        return entry is not None and entry[0] >= quantity
+
+    def stats(self):
+        return {"products": len(self._products),
+                "loads": self.loads,
+                "resumes": self.resumes,
+                "events": self.events,
+                "last_event_at": self.last_event_at}
@@ -0,0 +1,294 @@
+import bisect
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+
+from pymongo import monitoring
+"""
+    Per-operation instrumentation of the store
+    Every public store function is wrapped with @track. While it runs, every driver command
+    (seen through pymongo command monitoring) is counted against it, so N+1 query patterns
+    show up as a high commands-per-call. Call latencies go into fixed-bucket histograms and
+    calls slower than the threshold are logged.
+    Usage:
+        store_monitoring.enable(slow_ms=200)   # before creating the MongoClient/Store
+        ...
+        print(store_monitoring.snapshot())
+"""
+
+logger = logging.getLogger("store_monitoring")
+
+# Upper bounds of the latency buckets in milliseconds, the last bucket is everything above
+BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# Name of the store function running in this thread/task
+_current_operation = contextvars.ContextVar("store_operation", default=None)
+
+
+class _OperationStats:
+    """Counters of one store function"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.commands = {}
+        self.command_ms = 0.0
+        self.failed_commands = 0
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of calls"""
+        if not self.calls:
+            return 0.0
+        rank = fraction * self.calls
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return BUCKETS_MS[index] if index < len(BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def as_dict(self):
+        commands = sum(self.commands.values())
+        return {"calls": self.calls,
+                "errors": self.errors,
+                "total_ms": self.total_ms,
+                "mean_ms": self.total_ms / self.calls if self.calls else 0.0,
+                "p50_ms": self.percentile(0.50),
+                "p99_ms": self.percentile(0.99),
+                "max_ms": self.max_ms,
+                "histogram": {"bounds_ms": list(BUCKETS_MS), "counts": list(self.buckets)},
+                "commands": dict(self.commands),
+                "commands_per_call": commands / self.calls if self.calls else float(commands),
+                "command_ms": self.command_ms,
+                "failed_commands": self.failed_commands}
+
+
+class StoreMonitor(monitoring.CommandListener):
+    """
+        Purpose: Collects per-operation latencies and attributes driver commands to store functions
+        Notes: Commands issued outside any store function are counted under "<unattributed>"
+    """
+
+    def __init__(self, slow_ms=500.0):
+        self.enabled = False
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self._operations = {}
+        # request_id -> operation, commands finish on the thread that started them but this keeps it explicit
+        self._pending = {}
+
+    def _stats(self, operation):
+        stats = self._operations.get(operation)
+        if stats is None:
+            stats = self._operations[operation] = _OperationStats()
+        return stats
+
+    def record_call(self, operation, elapsed_ms, failed, commands_before):
+        with self._lock:
+            stats = self._stats(operation)
+            stats.calls += 1
+            stats.errors += failed
+            stats.total_ms += elapsed_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+            stats.buckets[bisect.bisect_left(BUCKETS_MS, elapsed_ms)] += 1
+            commands = sum(stats.commands.values()) - commands_before
+        if elapsed_ms >= self.slow_ms:
+            logger.warning("Slow operation %s: %.1f ms, %d commands", operation, elapsed_ms, commands)
+
+    def command_count(self, operation):
+        with self._lock:
+            stats = self._operations.get(operation)
+            return sum(stats.commands.values()) if stats else 0
+
+    def started(self, event):
+        operation = _current_operation.get() or "<unattributed>"
+        with self._lock:
+            self._pending[event.request_id] = operation
+            commands = self._stats(operation).commands
+            commands[event.command_name] = commands.get(event.command_name, 0) + 1
+
+    def succeeded(self, event):
+        with self._lock:
+            operation = self._pending.pop(event.request_id, "<unattributed>")
+            self._stats(operation).command_ms += event.duration_micros / 1000
+
+    def failed(self, event):
+        with self._lock:
+            operation = self._pending.pop(event.request_id, "<unattributed>")
+            stats = self._stats(operation)
+            stats.command_ms += event.duration_micros / 1000
+            stats.failed_commands += 1
+
+    def snapshot(self):
+        """
+            Return: dict operation -> counters, latency percentiles, histogram and command counts
+        """
+        with self._lock:
+            return {operation: stats.as_dict() for operation, stats in sorted(self._operations.items())}
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
+            self._pending.clear()
+
+
+MONITOR = StoreMonitor()
+
+
+def enable(slow_ms=None):
+    """
+        Purpose: Start collecting and register the command listener for every MongoClient created afterwards
+        Notes: Clients created earlier can get it with MongoClient(event_listeners=[store_monitoring.MONITOR])
+    """
+    if slow_ms is not None:
+        MONITOR.slow_ms = slow_ms
+    if not MONITOR.enabled:
+        MONITOR.enabled = True
+        monitoring.register(MONITOR)
+
+
+def disable():
+    """Stop timing store functions, the registered listener only keeps counting commands"""
+    MONITOR.enabled = False
+
+
+def snapshot():
+    return MONITOR.snapshot()
+
+
+def export_json(path=None):
+    """
+        Purpose: Export the snapshot as JSON
+        Return: the JSON text, also written to path if given
+    """
+    text = json.dumps(MONITOR.snapshot(), indent=2)
+    if path:
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+    return text
+
+
+def reset():
+    MONITOR.reset()
+
+
+def track(function):
+    """
+        Purpose: Decorator that attributes commands and latency to a store function
+        Notes: Only the outermost store function is recorded, so helpers and nested calls
+         (view_orders_by_customer -> iter_orders_by_customer) count towards the caller.
+         Works with plain, generator, coroutine and async generator functions.
+    """
+    name = function.__name__
+
+    def begin():
+        if not MONITOR.enabled or _current_operation.get() is not None:
+            return None
+        return _current_operation.set(name), time.perf_counter(), MONITOR.command_count(name)
+
+    def end(state, failed):
+        token, start, commands_before = state
+        _current_operation.reset(token)
+        MONITOR.record_call(name, 1000 * (time.perf_counter() - start), failed, commands_before)
+
+    if inspect.isasyncgenfunction(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            generator = function(*args, **kwargs)
+            elapsed = 0.0
+            failed = False
+            outermost = False
+            commands_before = MONITOR.command_count(name)
+            try:
+                while True:
+                    # The operation is only set while the generator runs, not while the caller handles an item
+                    state = begin()
+                    outermost = outermost or state is not None
+                    start = time.perf_counter()
+                    try:
+                        item = await generator.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    except Exception:
+                        failed = True
+                        raise
+                    finally:
+                        elapsed += time.perf_counter() - start
+                        if state is not None:
+                            _current_operation.reset(state[0])
+                    yield item
+            finally:
+                await generator.aclose()
+                if outermost:
+                    MONITOR.record_call(name, 1000 * elapsed, failed, commands_before)
+        return wrapper
+
+    if inspect.isgeneratorfunction(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            generator = function(*args, **kwargs)
+            elapsed = 0.0
+            failed = False
+            outermost = False
+            commands_before = MONITOR.command_count(name)
+            try:
+                while True:
+                    # The operation is only set while the generator runs, not while the caller handles an item
+                    state = begin()
+                    outermost = outermost or state is not None
+                    start = time.perf_counter()
+                    try:
+                        item = next(generator)
+                    except StopIteration:
+                        break
+                    except Exception:
+                        failed = True
+                        raise
+                    finally:
+                        elapsed += time.perf_counter() - start
+                        if state is not None:
+                            _current_operation.reset(state[0])
+                    yield item
+            finally:
+                generator.close()
+                if outermost:
+                    MONITOR.record_call(name, 1000 * elapsed, failed, commands_before)
+        return wrapper
+
+    if inspect.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            state = begin()
+            if state is None:
+                return await function(*args, **kwargs)
+            failed = False
+            try:
+                return await function(*args, **kwargs)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                end(state, failed)
+        return wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        state = begin()
+        if state is None:
+            return function(*args, **kwargs)
+        failed = False
+        try:
+            return function(*args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            end(state, failed)
+    return wrapper
@@ -0,0 +1,110 @@
+import bisect
+import re
+import threading
+"""
+    In-memory token index of product names for find_products
+    Names are split into lowercase word tokens. A query matches the products that have a word
+    starting with every query word, so "log mou" finds "Logitech Mouse" while the user is still
+    typing. Tokens are also kept in a sorted list, a prefix lookup is a bisect plus a scan over
+    the matching tokens only.
+"""
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower()) if isinstance(text, str) else []
+
+
+class NameIndex:
+    """
+        Purpose: Token -> product_id index of product names
+        Notes: Safe to share between threads. add_product, update_product and delete_one keep it
+         in sync when they are given the index, load() fills it from the products collection.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # token -> set of product_ids
+        self._postings = {}
+        # every token of _postings, sorted
+        self._tokens = []
+        # product_id -> tokens of its name
+        self._names = {}
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._names)
+
+    def load(self, products_collection, batch_size=5000):
+        """
+            Purpose: Rebuild the index from the names in the products collection
+            Return: number of indexed products
+        """
+        cursor = products_collection.find({}, {"_id": 0, "product_id": 1, "name": 1}).batch_size(batch_size)
+        postings = {}
+        names = {}
+        with cursor:
+            for product in cursor:
+                tokens = frozenset(tokenize(product.get("name")))
+                names[product["product_id"]] = tokens
+                for token in tokens:
+                    postings.setdefault(token, set()).add(product["product_id"])
+        with self._lock:
+            self._postings = postings
+            self._tokens = sorted(postings)
+            self._names = names
+            self.loaded = True
+        return len(names)
+
+    def _remove(self, product_id):
+        for token in self._names.pop(product_id, ()):
+            product_ids = self._postings[token]
+            product_ids.discard(product_id)
+            if not product_ids:
+                del self._postings[token]
+                del self._tokens[bisect.bisect_left(self._tokens, token)]
+
+    def add(self, product_id, name):
+        """Index a product's name, replacing the name it had before"""
+        tokens = frozenset(tokenize(name))
+        with self._lock:
+            self._remove(product_id)
+            self._names[product_id] = tokens
+            for token in tokens:
+                product_ids = self._postings.get(token)
+                if product_ids is None:
+                    product_ids = self._postings[token] = set()
+                    bisect.insort(self._tokens, token)
+                product_ids.add(product_id)
+
+    def remove(self, product_id):
+        with self._lock:
+            self._remove(product_id)
+
+    def _prefixed(self, prefix):
+        """Union of the product_ids of every token starting with prefix"""
+        product_ids = set()
+        index = bisect.bisect_left(self._tokens, prefix)
+        while index < len(self._tokens) and self._tokens[index].startswith(prefix):
+            product_ids |= self._postings[self._tokens[index]]
+            index += 1
+        return product_ids
+
+    def search(self, query):
+        """
+            Purpose: Find the products whose name has a word starting with every word of the query
+            Return: set of product_ids, empty if the query has no words
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return set()
+        with self._lock:
+            # Intersect starting with the most selective word
+            matches = sorted((self._prefixed(token) for token in set(tokens)), key=len)
+            result = set(matches[0])
+            for product_ids in matches[1:]:
+                if not result:
+                    break
+                result &= product_ids
+        return result
@@ -0,0 +1,167 @@
+import re
+"""
+    Validation rules for products, customers and orders
+    Everything (type maps, compiled patterns) is built once at import time and shared by
+    the add/update functions, the async API and the bulk importer.
+"""
+
+# Accepts exactly what the split-based checks accept: user@domain.ext with non-empty parts
+EMAIL_PATTERN = re.compile(r"[^@]+@[^@.]+\.[^@.]")
+# At least 7 digits, only spaces, dashes and parentheses between them
+PHONE_PATTERN = re.compile(r"[-() ]*(?:\d[-() ]*){7,}")
+PHONE_CHARACTERS = re.compile(r"[^-() \d]")
+
+
+def email_error(email):
+    """
+        Purpose: Validate an email address
+        Notes: The compiled pattern accepts valid emails in one call, the reason is only worked out on failure
+        Return: error message if the email is invalid, else None
+    """
+    if EMAIL_PATTERN.match(email):
+        return None
+    if email.find("@") == -1:
+        return f"Invalid email: {email}, must include @"
+    email_test = email.split("@")
+    if not email_test[0]:
+        return f"Invalid email: {email}, username can't be empty or start with @"
+    if not email_test[1]:
+        return f"Invalid email: {email}, domain can't be empty"
+    email_test = email_test[1]
+    if email_test.find(".") == -1:
+        return f"Invalid email: {email}, domain must include ."
+    email_test = email_test.split(".")
+    if not email_test[0]:
+        return f"Invalid email: {email}, left side of domain cant't be empty"
+    return f"Invalid email: {email}, right side of domain cant't be empty"
+
+
+def phone_error(phone):
+    """
+        Purpose: Validate a phone number, at least 7 digits and only " ", "-", "(", ")" besides them
+        Return: error message if the phone number is invalid, else None
+    """
+    if PHONE_PATTERN.fullmatch(phone):
+        return None
+    invalid = PHONE_CHARACTERS.search(phone)
+    if invalid:
+        return f"Invalid phone number: {phone}, can't include {invalid.group()}"
+    return f"Invalid phone number: {phone}, can't be less than 7 digits"
+
+
+class Validator:
+    """
+        Purpose: Rules for one kind of record
+        fields: field name -> expected type(s) of a new record
+        updatable: fields that can be changed by an update
+        checks: field name -> function(value) returning an error message or None
+    """
+
+    def __init__(self, name, fields, updatable, checks=None):
+        self.name = name
+        # (field name, expected types, is text) for every field, so checks don't rebuild anything per call
+        self.fields = tuple((field_name, expected_type, expected_type is str)
+                            for field_name, expected_type in fields.items())
+        self.updatable = {field_name: fields[field_name] for field_name in updatable}
+        self.checks = tuple((checks or {}).items())
+
+    def validate(self, record):
+        """
+            Purpose: Validate a new record: field types, no empty strings and field checks
+            Return: error message if the record is invalid, else None
+        """
+        for field_name, expected_type, _ in self.fields:
+            if not isinstance(record.get(field_name), expected_type):
+                return f"Field {field_name} should be of type {expected_type}"
+        # Check if not empty
+        for field_name, _, is_text in self.fields:
+            if is_text and not record[field_name].strip():
+                return f"{field_name.title()} must be at least 1 character!"
+        for field_name, check in self.checks:
+            error = check(record[field_name])
+            if error:
+                return error
+        return None
+
+    def validate_many(self, records):
+        """
+            Purpose: Validate many new records in one call
+            Return: list with one error message or None per record
+        """
+        validate = self.validate
+        return [validate(record) if isinstance(record, dict) else f"Error: each {self.name} must be a dictionary!"
+                for record in records]
+
+    def validate_update(self, updates):
+        """
+            Purpose: Validate the fields of an update: allowed fields, types, no empty strings and field checks
+            Return: error message if the update is invalid, else None
+        """
+        for field_name, value in updates.items():
+            if field_name not in self.updatable:
+                return f"Field {field_name} is not a valid field for update."
+            if not isinstance(value, self.updatable[field_name]):
+                return f"Error: wrong data type in update_{self.name} {updates}"
+        # Check if not empty
+        for value in updates.values():
+            if isinstance(value, str) and not value.strip():
+                return f"Update value must be at least 1 character!"
+        for field_name, check in self.checks:
+            if field_name in updates:
+                error = check(updates[field_name])
+                if error:
+                    return error
+        return None
+
+
+class OrderValidator(Validator):
+    """
+        Purpose: Rules for orders: order_id, customer_id and a non-empty list of items
+         with a product_id and a positive quantity
+    """
+
+    def __init__(self):
+        super().__init__("order", {"order_id": str, "customer_id": str}, ())
+
+    def validate(self, record):
+        items = record.get("items")
+        # Check if items are not empty
+        if not isinstance(items, list) or not items:
+            return "Error: in add-order items must be a non-empty list!"
+
+        # Check if not empty
+        for field_name, expected_type, _ in self.fields:
+            value = record.get(field_name)
+            if not isinstance(value, expected_type) or not value.strip():
+                return "All order values must be at least 1 character!"
+        for item in items:
+            if not isinstance(item, dict):
+                return "Error: each item must be a dictionary!"
+            for value in item.values():
+                if isinstance(value, str) and not value.strip():
+                    return "All values in items must be at least 1 character!"
+            if not isinstance(item.get("product_id"), str) or not isinstance(item.get("quantity"), int):
+                return "Error: invalid product_id or quantity type!"
+            if item["quantity"] < 1:
+                return "Error: quantity must be at least 1!"
+        return None
+
+
+PRODUCT_VALIDATOR = Validator("product",
+                              {"product_id": str,
+                               "name": str,
+                               "price": (int, float),
+                               "stock": int,
+                               "category": str},
+                              ("name", "price", "stock", "category"))
+
+CUSTOMER_VALIDATOR = Validator("customer",
+                               {"customer_id": str,
+                                "name": str,
+                                "email": str,
+                                "phone": str,
+                                "address": str},
+                               ("name", "email", "phone", "address"),
+                               checks={"email": email_error, "phone": phone_error})
+
+ORDER_VALIDATOR = OrderValidator()
@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+"""
+    Shared fixtures, the store tests run on in-memory mongomock like the benchmarks' mock backend
+"""
+
+
+@pytest.fixture(autouse=True)
+def quiet_store():
+    from store_errors import set_quiet
+    set_quiet()
+    yield
+    set_quiet(False)
+
+
+@pytest.fixture
+def collections():
+    """(db, products, customers, orders) of a fresh in-memory database with two products and two customers"""
+    mongomock = pytest.importorskip("mongomock")
+    import online_strone_database as store
+    db, products, customers, orders = store.create_database(mongomock.MongoClient())
+    store.add_product(products, "P1", "Keyboard", 50.0, 10, "Peripherals")
+    store.add_product(products, "P2", "Mouse", 20.0, 5, "Peripherals")
+    store.add_customer(customers, "C1", "Anna", "anna@email.com", "123456789", "Street 1")
+    store.add_customer(customers, "C2", "Jan", "jan@email.com", "987654321", "Street 2")
+    return db, products, customers, orders
+
+
+def stock(products, product_id):
+    return products.find_one({"product_id": product_id})["stock"]
@@ -0,0 +1,82 @@
+import pytest
+
+import online_strone_database as store
+from conftest import stock
+from store_errors import DUPLICATE, INVALID
+
+
+class _Interrupted(Exception):
+    pass
+
+
+def _add_orders(collections, *order_ids):
+    db, products, customers, orders = collections
+    for order_id in order_ids:
+        assert store.add_order(orders, customers, products, order_id, "C1", [{"product_id": "P2", "quantity": 1}])
+
+
+def _order_ids(collection):
+    return sorted(order["order_id"] for order in collection.find())
+
+
+def test_archive_orders_needs_a_cutoff(collections):
+    assert store.archive_orders(collections[3]).code == INVALID
+
+
+def test_archive_orders_resumes_after_interruption(collections, monkeypatch):
+    db, products, customers, orders = collections
+    archive = db[store.ARCHIVE_COLLECTION]
+    _add_orders(collections, "O1", "O2", "O3", "O4", "O5")
+
+    def sleep(seconds):
+        raise _Interrupted
+    monkeypatch.setattr(store.time, "sleep", sleep)
+    with pytest.raises(_Interrupted):
+        store.archive_orders(orders, cutoff_order_id="O5", batch_size=2, pause=0.1)
+    monkeypatch.undo()
+    assert _order_ids(archive) == ["O1", "O2"]
+    # Stopped between the archive write and the delete of a batch: the copy is already archived
+    archive.insert_one(orders.find_one({"order_id": "O3"}))
+
+    assert store.archive_orders(orders, cutoff_order_id="O5", batch_size=2) == {"archived": 2, "failed": 0,
+                                                                               "batches": 1}
+    assert _order_ids(orders) == ["O5"]
+    assert _order_ids(archive) == ["O1", "O2", "O3", "O4"]
+
+
+def test_check_archive_rejects_archived_order_ids(collections):
+    db, products, customers, orders = collections
+    _add_orders(collections, "O1")
+    store.archive_orders(orders, cutoff_order_id="O2")
+    result = store.add_order(orders, customers, products, "O1", "C1", [{"product_id": "P2", "quantity": 1}],
+                             check_archive=True)
+    assert result.code == DUPLICATE
+    results = store.add_orders_bulk(orders, customers, products, [
+        {"order_id": "O1", "customer_id": "C1", "items": [{"product_id": "P2", "quantity": 1}]}], check_archive=True)
+    assert results[0]["error"].code == DUPLICATE
+    assert stock(products, "P2") == 4
+
+
+def test_order_with_archived_order_id_stays_in_orders(collections):
+    db, products, customers, orders = collections
+    archive = db[store.ARCHIVE_COLLECTION]
+    _add_orders(collections, "O1")
+    store.archive_orders(orders, cutoff_order_id="O2")
+    # Without check_archive the archived order_id can be reused
+    assert store.add_order(orders, customers, products, "O1", "C1", [{"product_id": "P1", "quantity": 1}])
+    _add_orders(collections, "O2")
+
+    assert store.archive_orders(orders, cutoff_order_id="O3") == {"archived": 1, "failed": 1, "batches": 1}
+    assert _order_ids(orders) == ["O1"]
+    assert _order_ids(archive) == ["O1", "O2"]
+    assert archive.find_one({"order_id": "O1"})["t"] == 2000
+
+
+def test_export_includes_archived_orders(collections, tmp_path):
+    pytest.importorskip("numpy")
+    import store_export
+    db, products, customers, orders = collections
+    _add_orders(collections, "O1", "O2")
+    store.archive_orders(orders, cutoff_order_id="O2")
+    assert store_export.export_snapshot(db, str(tmp_path / "all"))["orders"] == 2
+    assert store_export.export_snapshot(db, str(tmp_path / "live"), include_archive=False)["orders"] == 1
@@ -0,0 +1,64 @@
+import online_strone_database as store
+
+
+def _stats(db, customer_id):
+    return db["customer_stats"].find_one({"_id": customer_id}, {"_id": 0})
+
+
+def _add(collections, order_id, customer_id, quantity=1):
+    db, products, customers, orders = collections
+    assert store.add_order(orders, customers, products, order_id, customer_id,
+                           [{"product_id": "P2", "quantity": quantity}])
+
+
+def test_orders_increment_stats(collections):
+    db = collections[0]
+    _add(collections, "O1", "C1")
+    _add(collections, "O2", "C1", 2)
+    store.add_orders_bulk(collections[3], collections[2], collections[1],
+                          [{"order_id": "O3", "customer_id": "C2", "items": [{"product_id": "P2", "quantity": 1}]}])
+    assert _stats(db, "C1") == {"order_count": 2, "total_spent": 60.0, "last_order_id": "O2"}
+    assert _stats(db, "C2") == {"order_count": 1, "total_spent": 20.0, "last_order_id": "O3"}
+
+
+def test_deletes_decrement_stats_and_keep_last_order(collections):
+    db, products, customers, orders = collections
+    for order_id in ("O1", "O2", "O3"):
+        _add(collections, order_id, "C1")
+    store.delete_one(orders, "O3")
+    assert _stats(db, "C1") == {"order_count": 2, "total_spent": 40.0, "last_order_id": "O2"}
+    store.delete_many_by_ids(orders, ["O2", "OX"])
+    assert _stats(db, "C1") == {"order_count": 1, "total_spent": 20.0, "last_order_id": "O1"}
+    store.delete_one(orders, "O1")
+    assert _stats(db, "C1") == {"order_count": 0, "total_spent": 0.0, "last_order_id": None}
+
+
+def test_last_order_falls_back_to_the_archive(collections):
+    db, products, customers, orders = collections
+    _add(collections, "O1", "C1")
+    store.archive_orders(orders, cutoff_order_id="O2")
+    _add(collections, "O2", "C1")
+    store.delete_one(orders, "O2")
+    assert _stats(db, "C1") == {"order_count": 1, "total_spent": 20.0, "last_order_id": "O1"}
+
+
+def test_deleting_an_order_without_stats_creates_no_entry(collections):
+    db, products, customers, orders = collections
+    orders.insert_one({"order_id": "O9", "customer_id": "C9", "v": 2, "l": [], "t": 1000})
+    assert store.delete_one(orders, "O9")
+    assert _stats(db, "C9") is None
+
+
+def test_reports_stream_sorted_rows(collections):
+    db, products, customers, orders = collections
+    _add(collections, "O1", "C1")
+    _add(collections, "O2", "C1")
+    _add(collections, "O3", "C2", 3)
+    assert [(row["customer_id"], row["order_count"]) for row in store.count_orders_per_customer(orders)] == \
+        [("C1", 2), ("C2", 1)]
+    assert [(row["customer_id"], row["total_spent"]) for row in store.total_spent_per_customer(orders)] == \
+        [("C2", 60.0), ("C1", 40.0)]
+    report = store.order_report(orders, top_n=1)
+    assert [row["customer_id"] for row in report["top_customers"]] == ["C2"]
+    assert report["totals"] == {"customers": 2, "orders": 3, "total_spent": 100.0, "average_order": 100.0 / 3}
+    assert len(store.order_report(orders, top_n=None)["top_customers"]) == 2
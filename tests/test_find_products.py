@@ -0,0 +1,54 @@
+import online_strone_database as store
+from store_errors import INVALID
+from store_search import NameIndex
+
+
+def _add_products(products, name_index=None):
+    store.add_product(products, "P3", "Logitech Mouse", 30.0, 0, "Peripherals", name_index=name_index)
+    store.add_product(products, "P4", "Gaming Mouse Pad", 20.0, 7, "Accessories", name_index=name_index)
+
+
+def _ids(products):
+    return [product["product_id"] for product in products]
+
+
+def test_name_index_matches_word_prefixes(collections):
+    db, products, customers, orders = collections
+    index = NameIndex()
+    assert index.load(products) == 2
+    _add_products(products, index)
+    assert index.search("log mou") == {"P3"}
+    assert index.search("MOU") == {"P2", "P3", "P4"}
+    assert index.search("ouse") == set()
+    assert index.search("  ") == set()
+    store.update_product(products, "P3", name_index=index, name="Trackball")
+    assert index.search("mouse") == {"P2", "P4"}
+    store.delete_one(products, "P4", name_index=index)
+    assert index.search("mouse") == {"P2"}
+    assert len(index) == 3
+
+
+def test_find_products_filters_and_sorts(collections):
+    db, products, customers, orders = collections
+    _add_products(products)
+    assert _ids(store.find_products(products)) == ["P1", "P2", "P3", "P4"]
+    assert _ids(store.find_products(products, category="Peripherals", sort="-price")) == ["P1", "P3", "P2"]
+    # Equal prices go by product_id in the direction of the sort
+    assert _ids(store.find_products(products, max_price=20.0, sort="-price")) == ["P4", "P2"]
+    assert _ids(store.find_products(products, min_price=25.0, in_stock=True)) == ["P1"]
+    assert _ids(store.find_products(products, in_stock=False)) == ["P3"]
+    assert _ids(store.find_products(products, sort="price", limit=2)) == ["P2", "P4"]
+    assert store.find_products(products, sort="category").code == INVALID
+
+
+def test_name_query_gives_the_same_products_with_and_without_index(collections, monkeypatch):
+    db, products, customers, orders = collections
+    _add_products(products)
+    index = NameIndex()
+    index.load(products)
+    for query in ("mouse", "log mou", "pad gam", "nothing", ""):
+        expected = _ids(store.find_products(products, name_query=query))
+        assert _ids(store.find_products(products, name_query=query, name_index=index)) == expected
+    # Too many matches for one $in fall back to the regex
+    monkeypatch.setattr(store, "NAME_INDEX_MAX_IDS", 1)
+    assert _ids(store.find_products(products, name_query="mouse", name_index=index)) == ["P2", "P3", "P4"]
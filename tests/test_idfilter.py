@@ -0,0 +1,73 @@
+import pytest
+
+import online_strone_database as store
+from conftest import stock
+from store_errors import DUPLICATE
+from store_idfilter import BloomFilter, IdSet
+
+ITEMS = [{"product_id": "P2", "quantity": 1}]
+
+
+@pytest.mark.parametrize("make_filter", [lambda: BloomFilter(1000), IdSet])
+def test_filter_has_no_false_negatives(make_filter):
+    id_filter = make_filter()
+    for index in range(500):
+        id_filter.add(f"O{index}")
+    assert all(id_filter.might_contain(f"O{index}") for index in range(500))
+    stats = id_filter.stats()
+    assert (stats["checks"], stats["possible_hits"], stats["misses"]) == (500, 500, 0)
+
+
+def test_bloom_filter_false_positive_rate_matches_its_size():
+    bloom = BloomFilter(10_000, error_rate=0.01)
+    for index in range(10_000):
+        bloom.add(f"O{index}")
+    false_positives = sum(bloom.might_contain(f"X{index}") for index in range(10_000))
+    assert false_positives < 300
+    assert bloom.stats()["expected_false_positive_rate"] < 0.02
+    assert bloom.stats()["memory_bytes"] == (BloomFilter.bits_for(10_000, 0.01) + 7) // 8
+
+
+def test_id_set_forgets_removed_ids_and_bloom_filter_keeps_them():
+    bloom, id_set = BloomFilter(100), IdSet()
+    for id_filter in (bloom, id_set):
+        id_filter.add("O1")
+        id_filter.remove("O1")
+    assert bloom.might_contain("O1")
+    assert not id_set.might_contain("O1")
+    assert len(id_set) == 0
+
+
+def test_filters_need_their_storage_hooks():
+    from store_idfilter import _IdFilter
+    with pytest.raises(TypeError):
+        _IdFilter()
+
+
+def test_order_filter_rejects_duplicates_before_taking_stock(collections):
+    db, products, customers, orders = collections
+    order_filter = IdSet()
+    assert order_filter.load(orders, "order_id") == 0
+    assert store.add_order(orders, customers, products, "O1", "C1", ITEMS, order_filter=order_filter)
+    assert order_filter.might_contain("O1")
+    result = store.add_order(orders, customers, products, "O1", "C1", ITEMS, order_filter=order_filter)
+    assert result.code == DUPLICATE
+    results = store.add_orders_bulk(orders, customers, products, [
+        {"order_id": "O1", "customer_id": "C1", "items": ITEMS},
+        {"order_id": "O2", "customer_id": "C1", "items": ITEMS}], order_filter=order_filter)
+    assert results[0]["error"].code == DUPLICATE and results[1]["inserted_id"] is not None
+    assert stock(products, "P2") == 3
+    assert order_filter.stats()["duplicates"] == 2
+    store.delete_one(orders, "O2", id_filter=order_filter)
+    assert not order_filter.might_contain("O2")
+
+
+def test_order_filter_misses_still_hit_the_unique_index(collections):
+    db, products, customers, orders = collections
+    order_filter = IdSet()
+    order_filter.load(orders, "order_id")
+    # Written without the filter, e.g. by another process
+    assert store.add_order(orders, customers, products, "O1", "C1", ITEMS)
+    result = store.add_order(orders, customers, products, "O1", "C1", ITEMS, order_filter=order_filter)
+    assert result.code == DUPLICATE
+    assert stock(products, "P2") == 4
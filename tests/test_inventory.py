@@ -0,0 +1,158 @@
+import os
+import time
+import uuid
+
+import pymongo
+import pytest
+
+from store_inventory import InventorySnapshot
+"""
+    InventorySnapshot against a scripted change stream, and against a real replica set when
+    MONGODB_REPLSET_URI is set (e.g. mongodb://localhost:27017/?replicaSet=rs0)
+"""
+
+
+class FakeStream:
+    """Change stream that returns the scripted events, an exception in the script is raised and a function called"""
+
+    def __init__(self, events, token):
+        self.events = list(events)
+        self.resume_token = {"n": token}
+        self.closed = False
+
+    def try_next(self):
+        if not self.events:
+            time.sleep(0.001)
+            return None
+        event = self.events.pop(0)
+        if isinstance(event, Exception):
+            raise event
+        if callable(event):
+            event()
+            return None
+        self.resume_token = {"n": self.resume_token["n"] + 1}
+        return event
+
+    def close(self):
+        self.closed = True
+
+
+class ScriptedSnapshot(InventorySnapshot):
+    """Each opened stream gets the next script, resume_after of every open is recorded"""
+
+    def __init__(self, products_collection, scripts):
+        super().__init__(products_collection, retry_delay=0)
+        self.scripts = list(scripts)
+        self.opened = []
+
+    def _open_stream(self, resume_after=None):
+        self.opened.append(resume_after)
+        token = resume_after["n"] if resume_after else 100 * len(self.opened)
+        return FakeStream(self.scripts.pop(0) if self.scripts else [], token)
+
+
+def _change(operation, _id, product_id=None, stock=None, price=None):
+    change = {"operationType": operation, "documentKey": {"_id": _id}}
+    if product_id is not None:
+        change["fullDocument"] = {"_id": _id, "product_id": product_id, "stock": stock, "price": price}
+    return change
+
+
+def _wait(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def products():
+    mongomock = pytest.importorskip("mongomock")
+    products = mongomock.MongoClient().db.products
+    products.insert_many([{"_id": 1, "product_id": "P1", "stock": 3, "price": 10.0},
+                          {"_id": 2, "product_id": "P2", "stock": 0, "price": 20.0}])
+    return products
+
+
+def test_apply_events(products):
+    inventory = ScriptedSnapshot(products, [])
+    inventory._load()
+    assert inventory.get_many(["P1", "P2", "PX"]) == {"P1": {"stock": 3, "price": 10.0},
+                                                      "P2": {"stock": 0, "price": 20.0}}
+    assert inventory._apply(_change("insert", 3, "P3", 7, 5.0))
+    assert inventory._apply(_change("update", 1, "P1", 1, 12.0))
+    assert inventory._apply(_change("replace", 2, "P2-NEW", 4, 20.0))
+    assert inventory._apply(_change("delete", 3))
+    # An update whose product was deleted before the lookup has no document
+    assert inventory._apply(_change("update", 1))
+    assert not inventory._apply({"operationType": "invalidate"})
+
+    assert inventory.get("P1") is None
+    assert inventory.get("P2") is None
+    assert inventory.get("P3") is None
+    assert inventory.get("P2-NEW") == {"stock": 4, "price": 20.0}
+    assert inventory.in_stock("P2-NEW", 4) and not inventory.in_stock("P2-NEW", 5)
+    assert len(inventory) == 1
+    assert inventory.stats()["events"] == 5
+
+
+def test_resumes_after_network_error(products):
+    inventory = ScriptedSnapshot(products, [[_change("update", 1, "P1", 2, 10.0), pymongo.errors.AutoReconnect("x")],
+                                            [_change("update", 2, "P2", 9, 20.0)]])
+    inventory.start()
+    try:
+        _wait(lambda: inventory.stats()["events"] == 2)
+    finally:
+        inventory.stop()
+    # Resumed after the last applied event of the first stream, without a reload
+    assert inventory.opened == [None, {"n": 101}]
+    assert inventory.stats()["resumes"] == 1
+    assert inventory.stats()["loads"] == 1
+    assert (inventory.get("P1")["stock"], inventory.get("P2")["stock"]) == (2, 9)
+
+
+def test_reloads_when_stream_cannot_resume(products):
+    def change_without_event():
+        products.update_one({"_id": 1}, {"$set": {"stock": 42}})
+    inventory = ScriptedSnapshot(products, [
+        [change_without_event, pymongo.errors.OperationFailure("resume point gone")],
+        [{"operationType": "invalidate"}],
+        []])
+    inventory.start()
+    try:
+        _wait(lambda: inventory.stats()["loads"] == 3)
+    finally:
+        inventory.stop()
+    # Every reload opens a fresh stream and reads the products again
+    assert inventory.opened == [None, None, None]
+    assert inventory.get("P1")["stock"] == 42
+
+
+def test_stop_closes_the_stream(products):
+    inventory = ScriptedSnapshot(products, [])
+    inventory.start()
+    stream = inventory._stream
+    inventory.stop()
+    assert stream.closed
+    assert inventory._thread is None
+
+
+@pytest.mark.skipif(not os.environ.get("MONGODB_REPLSET_URI"), reason="needs MONGODB_REPLSET_URI of a replica set")
+def test_follows_a_replica_set():
+    client = pymongo.MongoClient(os.environ["MONGODB_REPLSET_URI"], serverSelectionTimeoutMS=2000)
+    db = client["inventory_test_" + uuid.uuid4().hex[:8]]
+    products = db["products"]
+    products.insert_one({"product_id": "P1", "stock": 3, "price": 10.0})
+    inventory = InventorySnapshot(products, max_await_ms=100)
+    inventory.start()
+    try:
+        assert inventory.get("P1") == {"stock": 3, "price": 10.0}
+        products.insert_one({"product_id": "P2", "stock": 1, "price": 5.0})
+        products.update_one({"product_id": "P1"}, {"$inc": {"stock": -3}})
+        _wait(lambda: inventory.get("P2") is not None and not inventory.in_stock("P1"))
+        products.delete_one({"product_id": "P2"})
+        _wait(lambda: inventory.get("P2") is None)
+    finally:
+        inventory.stop()
+        client.drop_database(db.name)
+        client.close()
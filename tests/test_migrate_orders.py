@@ -0,0 +1,54 @@
+import pytest
+
+import online_strone_database as store
+
+
+class _Interrupted(Exception):
+    pass
+
+
+def _v1_orders(orders, count):
+    orders.insert_many([{"order_id": f"O{index:03d}", "customer_id": "C1",
+                         "items": [{"product_id": "P1", "quantity": 1}, {"product_id": "P2", "quantity": 2}],
+                         "total_price": 85.0} for index in range(count)])
+
+
+def _interrupt_after_first_batch(monkeypatch):
+    def sleep(seconds):
+        raise _Interrupted
+    monkeypatch.setattr(store.time, "sleep", sleep)
+
+
+def test_migrate_orders_resumes_after_interruption(collections, monkeypatch):
+    db, products, customers, orders = collections
+    _v1_orders(orders, 5)
+    _interrupt_after_first_batch(monkeypatch)
+    with pytest.raises(_Interrupted):
+        store.migrate_orders(orders, products, batch_size=2, pause=0.1)
+    assert orders.count_documents({"v": 2}) == 2
+
+    monkeypatch.undo()
+    # A rerun only reads the orders that are still version 1
+    assert store.migrate_orders(orders, products, batch_size=2) == {"migrated": 3, "skipped": 0}
+    assert orders.count_documents({"v": {"$exists": False}}) == 0
+    order = store.normalize_order(orders.find_one({"order_id": "O004"}))
+    assert order["total_price"] == 85.0
+    assert order["items"] == [{"product_id": "P1", "quantity": 1, "price": 50.0},
+                              {"product_id": "P2", "quantity": 2, "price": 20.0}]
+
+
+def test_migrate_orders_resumes_after_logged_id(collections):
+    db, products, customers, orders = collections
+    _v1_orders(orders, 4)
+    first = list(orders.find().sort("_id", 1))
+    assert store.migrate_orders(orders, products, after=str(first[1]["_id"])) == {"migrated": 2, "skipped": 0}
+    assert [order.get("v") for order in orders.find().sort("_id", 1)] == [None, None, 2, 2]
+
+
+def test_migrated_orders_keep_their_totals(collections):
+    db, products, customers, orders = collections
+    assert store.add_order(orders, customers, products, "N1", "C2", [{"product_id": "P1", "quantity": 1}])
+    _v1_orders(orders, 3)
+    before = {order["order_id"]: store.order_total(order) for order in orders.find()}
+    store.migrate_orders(orders, products)
+    assert {order["order_id"]: store.order_total(order) for order in orders.find()} == before
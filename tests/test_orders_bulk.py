@@ -0,0 +1,41 @@
+import online_strone_database as store
+from conftest import stock
+from store_errors import DUPLICATE, INSUFFICIENT_STOCK, INVALID, NOT_FOUND
+
+
+def _order(order_id, customer_id, *items):
+    return {"order_id": order_id, "customer_id": customer_id,
+            "items": [{"product_id": product_id, "quantity": quantity} for product_id, quantity in items]}
+
+
+def test_add_orders_bulk_reports_every_order(collections):
+    db, products, customers, orders = collections
+    store.add_order(orders, customers, products, "O0", "C1", [{"product_id": "P2", "quantity": 1}])
+
+    results = store.add_orders_bulk(orders, customers, products, [
+        _order("O1", "C1", ("P1", 2)),
+        _order("O2", "CX", ("P1", 1)),
+        _order("O3", "C2", ("P2", 100)),
+        _order("O1", "C2", ("P1", 1)),
+        _order("O0", "C2", ("P1", 1)),
+        {"order_id": "O4", "customer_id": "C1", "items": []},
+        _order("O5", "C2", ("P1", 3), ("P2", 1)),
+    ])
+
+    assert [result["order_id"] for result in results] == ["O1", "O2", "O3", "O1", "O0", "O4", "O5"]
+    codes = [result["error"].code if result["error"] is not None else None for result in results]
+    assert codes == [None, NOT_FOUND, INSUFFICIENT_STOCK, DUPLICATE, DUPLICATE, INVALID, None]
+    assert all((result["inserted_id"] is None) == (result["error"] is not None) for result in results)
+    # Only the accepted orders took stock, the stored duplicate O0 gave its stock back
+    assert stock(products, "P1") == 10 - 2 - 3
+    assert stock(products, "P2") == 5 - 1 - 1
+    assert sorted(order["order_id"] for order in orders.find()) == ["O0", "O1", "O5"]
+
+
+def test_add_orders_bulk_earlier_orders_take_stock_first(collections):
+    db, products, customers, orders = collections
+    results = store.add_orders_bulk(orders, customers, products, [_order("O1", "C1", ("P2", 4)),
+                                                                  _order("O2", "C2", ("P2", 2))])
+    assert results[0]["error"] is None
+    assert results[1]["error"].code == INSUFFICIENT_STOCK
+    assert stock(products, "P2") == 1
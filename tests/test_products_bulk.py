@@ -0,0 +1,49 @@
+import online_strone_database as store
+from conftest import stock
+from store_errors import INVALID, NOT_FOUND
+from store_search import NameIndex
+
+
+def _by_id(results):
+    return {result["product_id"]: result for result in results}
+
+
+def test_update_products_bulk_reports_each_product(collections):
+    db, products, customers, orders = collections
+    index = NameIndex()
+    index.load(products)
+    results = _by_id(store.update_products_bulk(products, {
+        "P1": {"price": 45.0, "name": "Mechanical Keyboard"},
+        "P2": {"price": 20.0},
+        "P9": {"price": 1.0},
+        "PX": {"price": "cheap"},
+        "PY": "not a dict"}, name_index=index))
+    assert (results["P1"]["matched"], results["P1"]["modified"], results["P1"]["error"]) == (True, True, None)
+    assert (results["P2"]["matched"], results["P2"]["modified"]) == (True, False)
+    assert results["P9"]["error"].code == NOT_FOUND
+    assert results["PX"]["error"].code == INVALID
+    assert results["PY"]["error"].code == INVALID
+    assert products.find_one({"product_id": "P1"}, {"_id": 0, "price": 1, "name": 1}) == \
+        {"price": 45.0, "name": "Mechanical Keyboard"}
+    assert index.search("mech") == {"P1"}
+
+
+def test_restock_adds_to_stock(collections):
+    db, products, customers, orders = collections
+    results = _by_id(store.restock(products, {"P1": 5, "P2": 0, "P9": 3, "P3": True}))
+    assert results["P1"]["modified"] and results["P1"]["error"] is None
+    assert results["P2"]["error"].code == INVALID
+    assert results["P3"]["error"].code == INVALID
+    assert results["P9"]["error"].code == NOT_FOUND
+    assert (stock(products, "P1"), stock(products, "P2")) == (15, 5)
+
+
+def test_reprice_category_rejects_bad_arguments(collections):
+    # The update pipeline uses $round, which mongomock doesn't have, so only the validation is tested here
+    db, products, customers, orders = collections
+    assert store.reprice_category(products, " ", 10).code == INVALID
+    assert store.reprice_category(products, None, 10).code == INVALID
+    assert store.reprice_category(products, "Peripherals", -100).code == INVALID
+    assert store.reprice_category(products, "Peripherals", "10").code == INVALID
+    assert store.reprice_category(products, "Peripherals", True).code == INVALID
+    assert products.find_one({"product_id": "P1"})["price"] == 50.0
@@ -0,0 +1,36 @@
+import online_strone_database as store
+from conftest import stock
+from store_cache import ProductCache
+from store_errors import DUPLICATE, INSUFFICIENT_STOCK, NOT_FOUND
+
+
+def test_failed_reservation_gives_back_reserved_stock(collections):
+    db, products, customers, orders = collections
+    result = store.add_order(orders, customers, products, "O1", "C1",
+                             [{"product_id": "P1", "quantity": 4}, {"product_id": "P2", "quantity": 6}],
+                             reserve_stock=True)
+    assert result.code == INSUFFICIENT_STOCK
+    assert result.details["product_id"] == "P2"
+    assert (stock(products, "P1"), stock(products, "P2")) == (10, 5)
+    assert orders.count_documents({}) == 0
+
+
+def test_reservation_of_missing_product_gives_back_stock(collections):
+    db, products, customers, orders = collections
+    result = store.add_order(orders, customers, products, "O1", "C1",
+                             [{"product_id": "P1", "quantity": 1}, {"product_id": "PX", "quantity": 1}],
+                             reserve_stock=True)
+    assert result.code == NOT_FOUND
+    assert stock(products, "P1") == 10
+
+
+def test_duplicate_order_gives_back_reserved_stock(collections):
+    db, products, customers, orders = collections
+    assert store.add_order(orders, customers, products, "O1", "C1", [{"product_id": "P1", "quantity": 2}],
+                           reserve_stock=True)
+    # With a cache prices come from the cache and stock is always reserved with the conditional update
+    result = store.add_order(orders, customers, products, "O1", "C2", [{"product_id": "P1", "quantity": 3}],
+                             product_cache=ProductCache(products))
+    assert result.code == DUPLICATE
+    assert stock(products, "P1") == 8
+    assert orders.find_one({"order_id": "O1"})["customer_id"] == "C1"